@@ -0,0 +1,162 @@
+# Benchmark of the OLED display pipeline: page rendering, packing and I2C transfer
+# Runs against a virtual SSD1306, so no Pi is needed, e.g.:
+#   python benchmark_display.py --iterations 200 --byte-latency 0.0001 --output bench.json
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import PIL
+
+from ssd1306 import SSD1306_128_64
+from virtual_ssd1306 import VirtualSSD1306, VirtualGPIO
+from screen import Screen
+from benchmark_utils import summarize
+
+STAGES = ["render", "pack", "transmit"]
+
+class FixedStatistics:
+    # Stand-in for Statistics with fixed, representative values
+    def __init__(self):
+        self.values = {
+            "ip": "10.128.48.17",
+            "hostname": "rpi-tile-a01",
+            "cpu": 23.4,
+            "ram": 1536.0,
+            "ram_max": 3791.0,
+            "disk": 12.0,
+            "disk_max": 29.0,
+            "temperature": 48.2,
+        }
+
+    def get(self, key):
+        return self.values.get(key)
+
+class SlowVirtualSSD1306(VirtualSSD1306):
+    # Virtual display that takes a fixed time per byte on the bus
+    def __init__(self, byte_latency=0.0, **kwargs):
+        super(SlowVirtualSSD1306, self).__init__(**kwargs)
+        self.byte_latency = byte_latency
+
+    def writeList(self, register, data):
+        super(SlowVirtualSSD1306, self).writeList(register, data)
+        if self.byte_latency > 0:
+            time.sleep((len(data) + 1)*self.byte_latency)
+
+def pipeline(screen, page, cache):
+    # The stages of one page change, as Screen.draw_page() and the writer
+    # thread run them
+    display = screen.display
+    rendered = {}
+
+    def render():
+        rendered["key"] = screen.render_page(page)
+
+    def pack():
+        # Nothing to pack on a frame cache hit
+        if rendered["key"] is not None:
+            screen.pack_page(rendered["key"])
+
+    def transmit():
+        # What the writer thread does with a published frame
+        display.buffer[:] = screen.frame
+        display.display()
+
+    return [("render", render), ("pack", pack), ("transmit", transmit)]
+
+def run_pipeline(screen, page, cache):
+    # One page change, returns the duration of each stage in seconds
+    timings = {}
+    for stage, function in pipeline(screen, page, cache):
+        start = time.perf_counter()
+        function()
+        timings[stage] = time.perf_counter() - start
+    return timings
+
+def trace_pipeline(screen, page, cache):
+    # One page change, returns the peak bytes allocated by each stage
+    allocations = {}
+    for stage, function in pipeline(screen, page, cache):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        allocations[stage] = peak - before
+    return allocations
+
+def run_benchmark(iterations=100, byte_latency=0.0, chunk_size=None, cache=False):
+    device = SlowVirtualSSD1306(byte_latency=byte_latency)
+    display = SSD1306_128_64(rst=None, i2c=device, gpio=VirtualGPIO(), i2c_chunk_size=chunk_size)
+    screen = Screen(display)
+    if not cache:
+        screen.frame_cache_size = 0
+        screen.frame_cache.clear()
+    screen.register_statistics(FixedStatistics())
+    screen.flush()
+
+    results = {}
+    for page in screen.pages:
+        other_page = screen.pages[(screen.pages.index(page) + 1) % len(screen.pages)]
+        # Warm up glyph and layout caches; every measured change starts from
+        # the other page so it is a real page change
+        run_pipeline(screen, other_page, cache)
+        run_pipeline(screen, page, cache)
+
+        samples = {stage: [] for stage in STAGES}
+        device.reset_counters()
+        for _ in range(iterations):
+            run_pipeline(screen, other_page, cache)
+            timings = run_pipeline(screen, page, cache)
+            for stage in STAGES:
+                samples[stage].append(timings[stage])
+        counters = device.counters()
+
+        # Allocations are measured in a separate pass, tracing skews timing
+        allocations = {stage: [] for stage in STAGES}
+        tracemalloc.start()
+        for _ in range(min(iterations, 20)):
+            run_pipeline(screen, other_page, cache)
+            for stage, allocated in trace_pipeline(screen, page, cache).items():
+                allocations[stage].append(allocated)
+        tracemalloc.stop()
+
+        results[page] = {
+            stage: dict(summarize(samples[stage]), peak_alloc_bytes=max(allocations[stage]))
+            for stage in STAGES
+        }
+        # The counters cover changes to and from the page, halve them
+        results[page]["i2c"] = {
+            "transactions_per_change": counters["transactions"]/(2*iterations),
+            "bytes_per_change": counters["bytes"]/(2*iterations),
+        }
+
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "iterations": iterations,
+        "byte_latency_s": byte_latency,
+        "i2c_chunk_size": chunk_size,
+        "frame_cache": cache,
+        "pages": results,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the OLED render, pack and transmit pipeline")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--byte-latency", type=float, default=0.0, help="simulated I2C time per byte in seconds")
+    parser.add_argument("--chunk-size", type=int, default=None, help="I2C data bytes per transaction, default unlimited")
+    parser.add_argument("--cache", action="store_true", help="keep the rendered frame cache enabled")
+    parser.add_argument("--output", default=None, help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.iterations, args.byte_latency, args.chunk_size, args.cache)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
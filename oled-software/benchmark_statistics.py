@@ -0,0 +1,101 @@
+# Benchmark of one Statistics refresh: the shell pipelines it used to run
+# against the native collectors it uses now, e.g.:
+#   python benchmark_statistics.py --iterations 50 --output statistics.json
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from statistics import Statistics
+from benchmark_utils import summarize
+
+# The commands Statistics ran before it read the values natively
+LEGACY_COMMANDS = {
+    "ip": "hostname -I | cut -d' ' -f1",
+    "hostname": "cat /etc/hostname",
+    "cpu": "cut -f 1 -d \" \" /proc/loadavg",
+    "ram": "free -m | awk 'NR==2{printf \"%s\", $3}'",
+    "ram_max": "free -m | awk 'NR==2{printf \"%s\", $2}'",
+    "disk": "df -h | awk '$NF==\"/\"{printf \"%d\", $3}'",
+    "disk_max": "df -h | awk '$NF==\"/\"{printf \"%d\", $2}'",
+    "temperature": "vcgencmd measure_temp",
+}
+
+# Native keys of the statistics that were renamed, cpu used to be the load
+# average and is a utilization now
+NATIVE_KEYS = {"cpu": "load"}
+
+def legacy_update():
+    values = {}
+    for key, command in LEGACY_COMMANDS.items():
+        result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if result.returncode != 0:
+            # e.g. no vcgencmd off the Pi, the time spent still counts
+            continue
+        value = result.stdout.decode("utf-8")
+        if key == "temperature":
+            value = value.replace("temp=","").replace("'C","").strip()
+        try:
+            values[key] = float(value)
+        except ValueError:
+            values[key] = value.strip()
+    return values
+
+def native_update(statistics):
+    statistics.update(force=True)
+    return dict(statistics.values)
+
+def time_refreshes(function, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def run_benchmark(iterations=50):
+    statistics = Statistics(background=False)
+    legacy_values = legacy_update()
+    native_values = native_update(statistics)
+
+    results = {
+        "legacy": summarize(time_refreshes(legacy_update, iterations)),
+        "native": summarize(time_refreshes(lambda: native_update(statistics), iterations)),
+    }
+    collectors = {}
+    for key, collector in statistics.collectors.items():
+        try:
+            collectors[key] = summarize(time_refreshes(collector, iterations))
+        except Exception:
+            collectors[key] = None
+    results["native_collectors"] = collectors
+
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "iterations": iterations,
+        "refresh": results,
+        "speedup": results["legacy"]["mean_ms"]/results["native"]["mean_ms"],
+        # Keys whose values differ, e.g. when memory changed in between
+        "differences": {
+            key: {"legacy": legacy_values.get(key), "native": native_values.get(NATIVE_KEYS.get(key, key))}
+            for key in LEGACY_COMMANDS if legacy_values.get(key) != native_values.get(NATIVE_KEYS.get(key, key))
+        },
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark a Statistics refresh with shell commands and native collectors")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", default=None, help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.iterations)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,15 @@
+# Timing summaries shared by the benchmark scripts
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction*len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def summarize(samples):
+    # Durations in seconds to milliseconds: median, tail, mean and worst case
+    return {
+        "p50_ms": percentile(samples, 0.50)*1000,
+        "p99_ms": percentile(samples, 0.99)*1000,
+        "mean_ms": sum(samples)/len(samples)*1000,
+        "max_ms": max(samples)*1000,
+    }
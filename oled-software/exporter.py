@@ -0,0 +1,165 @@
+# Local metrics endpoint of the HAT service.  Serves the published Statistics
+# snapshot and the service state over HTTP, as JSON or Prometheus text:
+#   curl http://127.0.0.1:9101/metrics.json
+#   curl http://127.0.0.1:9101/metrics
+# or over a Unix socket:
+#   curl --unix-socket /run/hat-metrics.sock http://localhost/metrics.json
+# It can also be run on its own, with statistics only:
+#   python exporter.py --port 9101
+
+import argparse
+import json
+import os
+import re
+import socketserver
+import sys
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+
+def label_value(value):
+    # Escape a Prometheus label value
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def metric_name(name):
+    return "hat_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # Scrapes only read what was collected already, never collect
+    timeout = 5
+
+    def do_GET(self):
+        exporter = self.server.exporter
+        path = self.path.split("?", 1)[0]
+        if path in ("/", "/metrics.json"):
+            body = json.dumps(exporter.report()).encode("utf-8")
+            content_type = "application/json"
+        elif path == "/metrics":
+            body = exporter.prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class QuietServerMixin:
+    def handle_error(self, request, client_address):
+        # Scrapers hanging up early are not worth a traceback in the journal
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+class MetricsHTTPServer(QuietServerMixin, HTTPServer):
+    pass
+
+class UnixHTTPServer(QuietServerMixin, socketserver.UnixStreamServer):
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+class MetricsExporter:
+    def __init__(self, statistics, host="127.0.0.1", port=9101, unix_path=None, poll_interval=2):
+        # Listens on unix_path when given, on host:port otherwise
+        self.statistics = statistics
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.poll_interval = poll_interval
+        # name -> function returning the current state, called on every
+        # scrape, so it must only read attributes and never block
+        self.states = {}
+        self.server = None
+        self.server_thread = None
+
+    def register_state(self, name, function):
+        self.states[name] = function
+
+    def state(self):
+        state = {}
+        for name, function in self.states.items():
+            try:
+                state[name] = function()
+            except Exception:
+                # One broken state should not fail the whole scrape
+                state[name] = None
+        return state
+
+    def report(self):
+        # The sampler publishes a new snapshot whenever it collected, reading
+        # it never triggers collection
+        snapshot = self.statistics.published
+        now = time.monotonic()
+        return {
+            "time": time.time(),
+            "metrics": {key: {"value": value, "age": snapshot.age(key, now)} for key, value in snapshot.values.items()},
+            "state": self.state(),
+        }
+
+    def prometheus(self):
+        report = self.report()
+        lines = []
+        labels = {}
+        for key, metric in sorted(report["metrics"].items()):
+            if isinstance(metric["value"], float):
+                lines.append(f"{metric_name(key)} {metric['value']!r}")
+                lines.append(f"{metric_name(key)}_age_seconds {metric['age']:.3f}")
+            else:
+                labels[key] = metric["value"]
+        for name, value in sorted(report["state"].items()):
+            if isinstance(value, bool):
+                lines.append(f"{metric_name(name)} {int(value)}")
+            elif isinstance(value, (int, float)):
+                lines.append(f"{metric_name(name)} {value!r}")
+            elif isinstance(value, str):
+                labels[name] = value
+        # Text values, e.g. hostname and ip, are labels of an info metric
+        info = ",".join(f'{metric_name(key)[4:]}="{label_value(value)}"' for key, value in sorted(labels.items()))
+        lines.append(f"hat_info{{{info}}} 1")
+        return "\n".join(lines) + "\n"
+
+    def start(self):
+        if self.unix_path is not None:
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self.server = UnixHTTPServer(self.unix_path, MetricsHandler)
+        else:
+            self.server = MetricsHTTPServer((self.host, self.port), MetricsHandler)
+            # The port actually bound, port 0 picks a free one
+            self.port = self.server.server_address[1]
+        self.server.exporter = self
+        self.server_thread = Thread(target=self.server.serve_forever, args=(self.poll_interval,), daemon=True)
+        self.server_thread.start()
+        return self
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+        self.server = None
+
+if __name__ == '__main__':
+    from statistics import Statistics
+
+    parser = argparse.ArgumentParser(description="Serve the tile statistics over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9101)
+    parser.add_argument("--unix-socket", default=None, help="listen on this Unix socket instead")
+    args = parser.parse_args()
+
+    exporter = MetricsExporter(Statistics(), args.host, args.port, args.unix_socket).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        exporter.stop()
@@ -0,0 +1,198 @@
+import base64
+import json
+import math
+import os
+from collections import OrderedDict
+
+import PIL
+from PIL import Image, ImageDraw, ImageFont
+
+# Glyph spanning the full line height, see GlyphAtlas.glyph()
+REFERENCE = "|"
+# Version of the on-disk glyph cache format, see GlyphAtlas.save_cache()
+CACHE_VERSION = 1
+
+def default_cache_dir():
+    return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "oled-software")
+
+class GlyphAtlas:
+    def __init__(self, font, preload="", layout_cache_size=64):
+        # font is an ImageFont, or None when the atlas loads it lazily
+        self._font = font
+        self.path = None
+        self.point_size = None
+        self.cache_path = None
+        # Whether glyphs or advances were added since the cache was read
+        self.cache_dirty = False
+        # character -> (ink left, ink top, 1-bit ink mask or None, right, bottom)
+        self.glyphs = {}
+        # (previous, character) -> pen advance from previous to character
+        self.advances = {}
+        # text -> (width, height, [(pen x, glyph)]), bounded LRU
+        self.layouts = OrderedDict()
+        self.layout_cache_size = layout_cache_size
+        self.reference = None
+        self.preload(preload)
+
+    @classmethod
+    def truetype(cls, path, size, preload="", cache_dir=None, **kwargs):
+        # Atlas of a TrueType font that is only parsed once a glyph or advance
+        # is missing, glyphs are kept across runs in a cache under cache_dir
+        atlas = cls(None, **kwargs)
+        atlas.path = path
+        atlas.point_size = size
+        if cache_dir is not None:
+            name = os.path.splitext(os.path.basename(path))[0]
+            atlas.cache_path = os.path.join(cache_dir, f"{name}-{size}.json")
+            atlas.load_cache()
+        atlas.preload(preload)
+        return atlas
+
+    @property
+    def font(self):
+        if self._font is None:
+            self._font = ImageFont.truetype(self.path, self.point_size)
+        return self._font
+
+    def font_loaded(self):
+        return self._font is not None
+
+    def cache_key(self):
+        # The cache is only valid for the same font file, size and rasterizer
+        stat = os.stat(self.path)
+        return {"version": CACHE_VERSION, "pillow": PIL.__version__, "size": self.point_size, "font_bytes": stat.st_size, "font_mtime": stat.st_mtime}
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            if cache.get("key") != self.cache_key():
+                return False
+            glyphs = {}
+            for character, (left, top, right, bottom, width, height, mask) in cache["glyphs"].items():
+                if mask is not None:
+                    mask = Image.frombytes('1', (width, height), base64.b64decode(mask))
+                glyphs[character] = (left, top, mask, right, bottom)
+            advances = {(previous, character): advance for previous, character, advance in cache["advances"]}
+        except (OSError, ValueError, KeyError, TypeError):
+            # Missing or unreadable, the glyphs are rasterized again
+            return False
+        self.glyphs.update(glyphs)
+        self.advances.update(advances)
+        return True
+
+    def save_cache(self):
+        # Write the glyphs as 1-bit masks, only when something was added
+        if self.cache_path is None or not self.cache_dirty:
+            return False
+        glyphs = {}
+        for character, (left, top, mask, right, bottom) in self.glyphs.items():
+            if mask is None:
+                glyphs[character] = (left, top, right, bottom, 0, 0, None)
+            else:
+                glyphs[character] = (left, top, right, bottom, mask.width, mask.height, base64.b64encode(mask.tobytes()).decode("ascii"))
+        try:
+            cache = {
+                "key": self.cache_key(),
+                "glyphs": glyphs,
+                "advances": [(previous, character, advance) for (previous, character), advance in self.advances.items()],
+            }
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temporary = self.cache_path + ".tmp"
+            with open(temporary, "w") as f:
+                json.dump(cache, f, separators=(",", ":"))
+            os.replace(temporary, self.cache_path)
+        except OSError:
+            # A read-only file system only costs the FreeType load next start
+            return False
+        self.cache_dirty = False
+        return True
+
+    def preload(self, characters):
+        # Rasterize the characters and the advances between all of them, so
+        # any text made of them is laid out without the font
+        characters = "".join(sorted(set(characters)))
+        for character in characters:
+            self.glyph(character)
+        for previous in characters:
+            for character in characters:
+                self.advance(previous, character)
+
+    def glyph(self, character):
+        if character not in self.glyphs:
+            # Rasterize the glyph behind a reference bar that spans the full
+            # line height and measure it against that bar, so every glyph sits
+            # on the same baseline no matter how tall it is itself
+            margin = sum(self.font.getmetrics())
+            reference, (bar_left, bar_top, bar_right, _) = self.reference_bar(margin)
+            canvas = Image.new('1', reference.size)
+            draw = ImageDraw.Draw(canvas)
+            draw.text((margin, margin), REFERENCE + character, font=self.font, fill=255)
+            shift = canvas.crop((bar_left, 0, bar_right, canvas.height)).getbbox()[1] - bar_top
+            draw.rectangle((bar_left, 0, bar_right - 1, canvas.height), fill=0)
+            _, _, right, bottom = self.font.getbbox(character, mode='1')
+            box = canvas.getbbox()
+            if box is None:
+                self.glyphs[character] = (0, 0, None, right, bottom)
+            else:
+                left = box[0] - margin - round(self.advance(REFERENCE, character))
+                self.glyphs[character] = (left, box[1] - margin - shift, canvas.crop(box), right, bottom)
+            self.cache_dirty = True
+        return self.glyphs[character]
+
+    def reference_bar(self, margin):
+        if self.reference is None:
+            image = Image.new('1', (5*margin, 3*margin))
+            ImageDraw.Draw(image).text((margin, margin), REFERENCE, font=self.font, fill=255)
+            self.reference = (image, image.getbbox())
+        return self.reference
+
+    def advance(self, previous, character):
+        # Advance width of previous including its kerning with character
+        key = (previous, character)
+        if key not in self.advances:
+            self.advances[key] = self.font.getlength(previous + character, mode='1') - self.font.getlength(character, mode='1')
+            self.cache_dirty = True
+        return self.advances[key]
+
+    def layout(self, text):
+        if text in self.layouts:
+            self.layouts.move_to_end(text)
+            return self.layouts[text]
+
+        width = 0
+        height = 0
+        pen = 0
+        placed = []
+        previous = None
+        for character in text:
+            if previous is not None:
+                pen += self.advance(previous, character)
+            glyph = self.glyph(character)
+            if glyph[2] is not None:
+                placed.append((pen, glyph))
+            width = max(width, round(pen) + glyph[3])
+            height = max(height, glyph[4])
+            previous = character
+
+        self.layouts[text] = (width, height, placed)
+        if len(self.layouts) > self.layout_cache_size:
+            self.layouts.popitem(last=False)
+        return self.layouts[text]
+
+    def size(self, text):
+        width, height, _ = self.layout(text)
+        return width, height
+
+    def draw(self, image, xy, text, fill=None):
+        if fill is None:
+            fill = 255
+        # Like ImageDraw.text, fractional positions are carried into the pen
+        # and each glyph is rounded to the nearest pixel on its own
+        x, y = xy
+        origin_x, origin_y = int(x), int(y)
+        offset_y = origin_y + math.floor(y - origin_y + 0.5)
+        _, _, placed = self.layout(text)
+        for pen, (left, top, mask, _, _) in placed:
+            offset_x = origin_x + math.floor(x - origin_x + pen + 0.5)
+            image.paste(fill, (offset_x + left, offset_y + top), mask)
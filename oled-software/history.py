@@ -0,0 +1,167 @@
+import math
+import time
+from array import array
+
+# (seconds per entry, entries) of each history tier: every sample for ten
+# minutes, minutes for a day and quarter hours for a month.  Memory is fixed,
+# about 95 kB per metric.
+TIERS = ((0, 600), (60, 1440), (900, 2976))
+
+class RingBuffer:
+    # Fixed size ring of (timestamp, mean, min, max), overwriting the oldest
+    # entry when full; with extremes False only means are stored
+    def __init__(self, capacity, extremes=True):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8*capacity))
+        self.means = array('f', bytes(4*capacity))
+        self.minimums = array('f', bytes(4*capacity)) if extremes else self.means
+        self.maximums = array('f', bytes(4*capacity)) if extremes else self.means
+        # Index the next entry is written to and the number of entries
+        self.head = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def append(self, timestamp, mean, minimum=None, maximum=None):
+        self.timestamps[self.head] = timestamp
+        self.means[self.head] = mean
+        if self.minimums is not self.means:
+            self.minimums[self.head] = mean if minimum is None else minimum
+            self.maximums[self.head] = mean if maximum is None else maximum
+        self.head = (self.head + 1) % self.capacity
+        self.length = min(self.length + 1, self.capacity)
+
+    def indices(self, since=None):
+        # Indices of the entries from oldest to newest, only those at or after
+        # since; timestamps are increasing so the search stops at the first
+        # older entry from the newest end
+        start = self.head - self.length
+        if since is not None:
+            count = 0
+            while count < self.length and self.timestamps[(self.head - count - 1) % self.capacity] >= since:
+                count += 1
+            start = self.head - count
+        return [i % self.capacity for i in range(start, self.head)]
+
+    def entries(self, since=None):
+        return [(self.timestamps[i], self.means[i], self.minimums[i], self.maximums[i]) for i in self.indices(since)]
+
+    def oldest(self):
+        if self.length == 0:
+            return None
+        return self.timestamps[(self.head - self.length) % self.capacity]
+
+    def nbytes(self):
+        arrays = {id(a): a for a in (self.timestamps, self.means, self.minimums, self.maximums)}
+        return sum(a.itemsize*len(a) for a in arrays.values())
+
+class Tier:
+    # History at one resolution: samples are averaged into buckets of
+    # resolution seconds, resolution 0 keeps every sample
+    def __init__(self, resolution, capacity):
+        self.resolution = resolution
+        self.ring = RingBuffer(capacity, extremes=resolution > 0)
+        # Bucket being filled: [bucket, count, sum, min, max]
+        self.bucket = None
+
+    def append(self, timestamp, value):
+        if self.resolution == 0:
+            self.ring.append(timestamp, value)
+            return
+        bucket = math.floor(timestamp/self.resolution)
+        if self.bucket is not None and self.bucket[0] != bucket:
+            self.flush()
+        if self.bucket is None:
+            self.bucket = [bucket, 0, 0.0, value, value]
+        self.bucket[1] += 1
+        self.bucket[2] += value
+        self.bucket[3] = min(self.bucket[3], value)
+        self.bucket[4] = max(self.bucket[4], value)
+
+    def flush(self):
+        bucket, count, total, minimum, maximum = self.bucket
+        self.ring.append(bucket*self.resolution, total/count, minimum, maximum)
+        self.bucket = None
+
+    def span(self):
+        # Seconds the tier covers when full
+        return self.resolution*self.ring.capacity
+
+    def entries(self, since=None):
+        entries = self.ring.entries(since)
+        if self.bucket is not None:
+            # The bucket being filled counts too
+            bucket, count, total, minimum, maximum = self.bucket
+            entries.append((bucket*self.resolution, total/count, minimum, maximum))
+        return entries
+
+class MetricHistory:
+    # Bounded multi-resolution history of one metric, timestamps are
+    # time.monotonic() seconds
+    def __init__(self, tiers=TIERS):
+        self.tiers = [Tier(resolution, capacity) for resolution, capacity in tiers]
+
+    def append(self, value, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        for tier in self.tiers:
+            tier.append(timestamp, value)
+
+    def tier(self, window):
+        # Finest tier that still holds the start of the window
+        since = time.monotonic() - window
+        for tier in self.tiers:
+            oldest = tier.ring.oldest()
+            if oldest is None or oldest <= since or tier.ring.length < tier.ring.capacity:
+                return tier
+        return self.tiers[-1]
+
+    def entries(self, window, now=None):
+        # (timestamp, mean, min, max) over the last window seconds
+        if now is None:
+            now = time.monotonic()
+        return self.tier(window).entries(now - window)
+
+    def minimum(self, window):
+        return min((entry[2] for entry in self.entries(window)), default=None)
+
+    def maximum(self, window):
+        return max((entry[3] for entry in self.entries(window)), default=None)
+
+    def mean(self, window):
+        means = [entry[1] for entry in self.entries(window)]
+        return sum(means)/len(means) if means else None
+
+    def percentile(self, window, fraction):
+        # Nearest rank over the samples, or bucket means for coarse tiers
+        means = sorted(entry[1] for entry in self.entries(window))
+        if not means:
+            return None
+        return means[min(len(means) - 1, max(0, math.ceil(fraction*len(means)) - 1))]
+
+    def summary(self, window):
+        return {
+            "min": self.minimum(window),
+            "max": self.maximum(window),
+            "mean": self.mean(window),
+            "p95": self.percentile(window, 0.95),
+        }
+
+    def series(self, window, points, now=None):
+        # Mean per slot of window/points seconds, oldest first, None for
+        # slots without samples
+        if now is None:
+            now = time.monotonic()
+        start = now - window
+        sums = [0.0]*points
+        counts = [0]*points
+        for timestamp, mean, _, _ in self.entries(window, now):
+            slot = min(points - 1, int((timestamp - start)/window*points))
+            if slot >= 0:
+                sums[slot] += mean
+                counts[slot] += 1
+        return tuple(total/count if count else None for total, count in zip(sums, counts))
+
+    def nbytes(self):
+        return sum(tier.ring.nbytes() for tier in self.tiers)
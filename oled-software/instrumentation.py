@@ -0,0 +1,174 @@
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+from history import MetricHistory
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def thread_origin(thread):
+    # Where a thread's code lives, e.g. "screen.Screen.write_frames"; threads
+    # started outside Python, like the GPIO callback thread, are "external"
+    if thread is threading.main_thread():
+        return "main"
+    function = getattr(thread, "function", None) or getattr(thread, "_target", None)
+    if function is None:
+        return "external" if thread.name.startswith("Dummy") else thread.name
+    owner = getattr(function, "__self__", None)
+    if owner is not None and not isinstance(owner, types.ModuleType):
+        # Bound method, named after the class, which is where it was started
+        return f"{type(owner).__module__}.{type(owner).__qualname__}.{function.__name__}"
+    return f"{function.__module__}.{getattr(function, '__qualname__', function.__name__)}"
+
+def subsystem(origin):
+    return origin.split(".", 1)[0]
+
+def task_counters(tid):
+    # (CPU seconds, voluntary context switches) of one thread of this process
+    with open(f"/proc/self/task/{tid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12]))/CLOCK_TICKS
+    switches = 0
+    with open(f"/proc/self/task/{tid}/status") as f:
+        for line in f:
+            if line.startswith("voluntary_ctxt_switches"):
+                switches = int(line.split()[1])
+    return cpu, switches
+
+def process_counters():
+    # (CPU seconds, resident set size in bytes) of the whole process
+    with open("/proc/self/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    with open("/proc/self/statm") as f:
+        resident = int(f.read().split()[1])*PAGE_SIZE
+    return (int(fields[11]) + int(fields[12]))/CLOCK_TICKS, resident
+
+class Instrumentation:
+    # Samples the threads of the service every interval seconds: live threads
+    # by origin, CPU time and wakeups (voluntary context switches) per
+    # subsystem, and the resident set size over time.  Threads that live
+    # shorter than an interval are only partly seen, the process total keeps
+    # their CPU time as "unaccounted".
+    def __init__(self, interval=10):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        # tid -> (subsystem, CPU seconds, switches) as of the last sample
+        self.tasks = {}
+        # subsystem -> [CPU seconds, switches] of threads that have ended
+        self.retired = {}
+        # origin -> number of threads seen
+        self.threads_seen = {}
+        self.rates = {}
+        self.rss = MetricHistory()
+        self.cpu = MetricHistory()
+        self.last_sample = None
+        self.stopping = threading.Event()
+        self.sampler_thread = None
+
+    def start(self):
+        self.sample()
+        self.sampler_thread = threading.Thread(target=self.run, daemon=True)
+        self.sampler_thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.sample()
+            except OSError:
+                # /proc races with threads ending, the next sample catches up
+                pass
+
+    def live_threads(self):
+        origins = {}
+        for thread in threading.enumerate():
+            origin = thread_origin(thread)
+            origins[origin] = origins.get(origin, 0) + 1
+        return origins
+
+    def sample(self):
+        now = time.monotonic()
+        threads = {thread.native_id: thread_origin(thread) for thread in threading.enumerate()}
+        tasks = {}
+        for tid in os.listdir("/proc/self/task"):
+            tid = int(tid)
+            try:
+                cpu, switches = task_counters(tid)
+            except OSError:
+                # Ended in the meantime
+                continue
+            origin = threads.get(tid, "external")
+            tasks[tid] = (subsystem(origin), cpu, switches)
+            if tid not in self.tasks:
+                self.threads_seen[origin] = self.threads_seen.get(origin, 0) + 1
+        process_cpu, rss = process_counters()
+
+        with self.lock:
+            previous = self.totals()
+            for tid, (name, cpu, switches) in self.tasks.items():
+                if tid not in tasks:
+                    retired = self.retired.setdefault(name, [0.0, 0])
+                    retired[0] += cpu
+                    retired[1] += switches
+            self.tasks = tasks
+            totals = self.totals()
+            if self.last_sample is not None:
+                elapsed = now - self.last_sample[0]
+                self.rates = {
+                    name: {
+                        "cpu_percent": (cpu - previous.get(name, (0, 0))[0])/elapsed*100,
+                        "wakeups_per_second": (switches - previous.get(name, (0, 0))[1])/elapsed,
+                    }
+                    for name, (cpu, switches) in totals.items()
+                }
+                self.cpu.append((process_cpu - self.last_sample[1])/elapsed*100, now)
+            self.rss.append(rss, now)
+            self.last_sample = (now, process_cpu, rss)
+
+    def totals(self):
+        # subsystem -> (CPU seconds, switches) of live and ended threads
+        totals = {name: tuple(counters) for name, counters in self.retired.items()}
+        for name, cpu, switches in self.tasks.values():
+            total_cpu, total_switches = totals.get(name, (0.0, 0))
+            totals[name] = (total_cpu + cpu, total_switches + switches)
+        return totals
+
+    def report(self, window=3600):
+        # Only reads what the sampler collected, so a scrape never samples
+        if self.last_sample is None:
+            return {}
+        with self.lock:
+            totals = self.totals()
+            _, process_cpu, rss = self.last_sample
+            subsystems = {
+                name: dict({"cpu_seconds": cpu, "wakeups": switches}, **self.rates.get(name, {}))
+                for name, (cpu, switches) in totals.items()
+            }
+            report = {
+                "uptime": time.monotonic() - self.started,
+                "cpu_seconds": process_cpu,
+                "unaccounted_cpu_seconds": max(process_cpu - sum(cpu for cpu, _ in totals.values()), 0),
+                "rss_bytes": rss,
+                "rss": self.rss.summary(window),
+                "cpu_percent": self.cpu.summary(window),
+                "subsystems": subsystems,
+                "threads_seen": dict(self.threads_seen),
+            }
+        report["threads"] = self.live_threads()
+        report["thread_count"] = sum(report["threads"].values())
+        return report
+
+    def dump(self, file=None):
+        # Write the report as one JSON line, e.g. to the journal on SIGUSR1
+        if file is None:
+            file = sys.stderr
+        file.write(json.dumps(self.report(), sort_keys=True) + "\n")
+        file.flush()
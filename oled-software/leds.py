@@ -3,9 +3,14 @@ import board
 import neopixel
 from adafruit_blinka.microcontroller.bcm283x.pin import Pin
 from itertools import groupby
-from threading import Thread, Timer
+from threading import Thread, Timer, Lock, current_thread
+from collections import OrderedDict
 import math
 
+# Gamma corrected value of every 8 bit LED value, see LEDs.gamma_correct()
+GAMMA_FACTOR = 2.8
+GAMMA_TABLE = bytes(int(min(255, max(0, pow(value / 255.0, GAMMA_FACTOR) * 255.0))) for value in range(256))
+
 class LEDs:
     def __init__(self, gpio, number_of_leds, brightness=0.5, auto_write=False):
         self.number_of_leds = number_of_leds
@@ -19,6 +24,12 @@ class LEDs:
 
         self.fade_time = 0.5
         self.fade_steps = 50
+        # Frames of recent fades, effects repeat the same few fades over and
+        # over; keyed by start colors, target colors and number of steps
+        self.fade_cache = OrderedDict()
+        self.fade_cache_size = 32
+        # Backlight and effect threads can fade at the same time
+        self.fade_cache_lock = Lock()
 
         self.direction = 1
         # Define the current index of the bouncing LED
@@ -91,57 +102,57 @@ class LEDs:
         self.pixels.show()
 
     def gamma_correct(self, led_val):
-        factor = 2.8
+        if isinstance(led_val, int) and 0 <= led_val <= 255:
+            return GAMMA_TABLE[led_val]
+        factor = GAMMA_FACTOR
         max_val = (1 << 8) - 1.0
         corrected = pow(led_val / max_val, factor) * max_val
         return int(min(255, max(0, corrected)))
 
+    def fade_frames(self, start_colors, target_colors, fade_steps):
+        # (colors, gamma corrected colors) of every step of a fade
+        key = (tuple(start_colors), tuple(target_colors), fade_steps)
+        with self.fade_cache_lock:
+            if key in self.fade_cache:
+                self.fade_cache.move_to_end(key)
+                return self.fade_cache[key]
+
+        # All color components of all LEDs as one flat list, so every step
+        # is computed for the whole strip at once
+        current = [c for color in start_colors for c in color]
+        targets = [c for color in target_colors for c in color]
+
+        # Calculate the step size for each color component for each LED
+        step_sizes = [(target - start) / fade_steps for start, target in zip(current, targets)]
+
+        frames = []
+        for _ in range(fade_steps):
+            # Calculate the new RGB values based on the step sizes
+            current = [max(0, min(255, int(c + step))) for c, step in zip(current, step_sizes)]
+            # Gamma correct the whole frame with one table lookup
+            corrected = bytes(current).translate(GAMMA_TABLE)
+            frames.append((list(zip(current[0::3], current[1::3], current[2::3])), list(zip(corrected[0::3], corrected[1::3], corrected[2::3]))))
+
+        with self.fade_cache_lock:
+            self.fade_cache[key] = frames
+            if len(self.fade_cache) > self.fade_cache_size:
+                self.fade_cache.popitem(last=False)
+        return frames
+
     def fade_to(self, target_colors, fade_time=None, fade_steps=None, allow_effect_break=False):
         if fade_time is None:
             fade_time = self.fade_time
         if fade_steps is None:
         	fade_steps = self.fade_steps
 
-        # Calculate the step size for each color component for each LED
-        step_sizes = []
-        for i, target_color in enumerate(target_colors):
-            # Extract RGB values from the current color of the specified LED
-            r1, g1, b1 = self.current_colors[i]
-
-            # Extract RGB values from the target color
-            r2, g2, b2 = target_color
-
-            # Calculate the step size for each color component
-            step_r = (r2 - r1) / fade_steps
-            step_g = (g2 - g1) / fade_steps
-            step_b = (b2 - b1) / fade_steps
-
-            step_sizes.append((step_r, step_g, step_b))
-
-        # Initialize variables for the current colors
-        current_rs = [r1 for r1, _, _ in self.current_colors]
-        current_gs = [g1 for _, g1, _ in self.current_colors]
-        current_bs = [b1 for _, _, b1 in self.current_colors]
+        number_of_leds = len(target_colors)
+        frames = self.fade_frames(self.current_colors[:number_of_leds], target_colors, fade_steps)
 
         # Fade all LEDs to the target colors
-        for _ in range(fade_steps):
-            for i, target_color in enumerate(target_colors):
-                # Extract RGB values from the current color of the specified LED
-                current_r = current_rs[i]
-                current_g = current_gs[i]
-                current_b = current_bs[i]
-
-                # Extract RGB values from the target color
-                r2, g2, b2 = target_color
-
-                # Calculate the new RGB values based on the step sizes
-                current_rs[i] = max(0, min(255, int(current_r + step_sizes[i][0])))
-                current_gs[i] = max(0, min(255, int(current_g + step_sizes[i][1])))
-                current_bs[i] = max(0, min(255, int(current_b + step_sizes[i][2])))
-
-                self.current_colors[i] = (current_rs[i], current_gs[i], current_bs[i])
-                self.pixels[i] = (self.gamma_correct(current_rs[i]), self.gamma_correct(current_gs[i]), self.gamma_correct(current_bs[i]))
-
+        for colors, corrected in frames:
+            self.current_colors[:number_of_leds] = colors
+            # The whole gamma corrected frame is written to the strip in one go
+            self.pixels[0:number_of_leds] = corrected
             self.pixels.show()
 
             if allow_effect_break and not self.effect_running:
@@ -186,6 +197,8 @@ class LEDs:
     def start_bounce(self, target_color=None, delay=0, fade_time=0.01, fade_steps=10):
         if target_color is None:
             target_color = self.bounce_color
+        self.end_effect()
+        self.effect_running = True
         self.effect_thread = Thread(target=self.loop_bounce, args=(target_color,delay, fade_time, fade_steps))
         self.effect_thread.start()
         self.effect = "bounce"
@@ -194,6 +207,13 @@ class LEDs:
     def stop_effect(self):
         self.effect_running = False
 
+    def end_effect(self):
+        # Stop the running effect and wait for its thread, so only one effect
+        # ever drives the LEDs
+        self.stop_effect()
+        if self.effect_thread is not None and self.effect_thread is not current_thread():
+            self.effect_thread.join()
+
     def heartbeat(self, target_color, on_delay=0.3, fade_time=2, fade_steps=50):
         # Make sure we can immediately stop this effect (because we're rejoining threads when canceling)
         new_colors = [target_color]*self.number_of_leds
@@ -226,6 +246,8 @@ class LEDs:
     def start_heartbeat(self, target_color=None, on_delay=0.3, off_delay=10, fade_time=2, fade_steps=50):
         if target_color is None:
             target_color = self.heartbeat_color
+        self.end_effect()
+        self.effect_running = True
         self.effect_thread = Thread(target=self.loop_heartbeat, args=(target_color, on_delay, off_delay, fade_time, fade_steps))
         self.effect_thread.start()
         self.effect = "heartbeat"
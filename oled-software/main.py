@@ -2,6 +2,23 @@
 # To be run as a service
 
 import time
+
+# Startup phases and their durations, reported once the service runs
+startup_phases = []
+startup_time = time.perf_counter()
+
+def startup_phase(name):
+    # Record the phase that just ended
+    global startup_time
+    now = time.perf_counter()
+    startup_phases.append((name, now - startup_time))
+    startup_time = now
+
+def report_startup():
+    phases = ", ".join(f"{name} {duration*1000:.0f} ms" for name, duration in startup_phases)
+    total = sum(duration for _, duration in startup_phases)
+    print(f"Startup took {total*1000:.0f} ms: {phases}", flush=True)
+
 import os
 import sys
 import subprocess
@@ -10,6 +27,7 @@ from multiprocessing import Queue
 import RPi.GPIO as GPIO
 from threading import Timer, Thread
 import atexit
+import signal
 
 from board import SCL, SDA
 import busio
@@ -21,18 +39,60 @@ from proximity_sensor import ProximitySensor
 from leds import LEDs
 from screen import Screen
 from statistics import Statistics
+from exporter import MetricsExporter
+from instrumentation import Instrumentation
 
 BUTTON_LEFT_GPIO = 5
 BUTTON_RIGHT_GPIO = 6
 PROXIMITY_INT_GPIO = 26
 LEDS_GPIO = 18
 NUMBER_OF_LEDS = 5
+# Local metrics endpoint, see exporter.py; None turns it off
+EXPORTER_PORT = 9101
+# Serve on a Unix socket instead of the port when set
+EXPORTER_SOCKET = None
+startup_phase("imports")
 
 buttons = Buttons({"left": BUTTON_LEFT_GPIO, "right": BUTTON_RIGHT_GPIO})
+startup_phase("gpio")
 proximity_sensor = ProximitySensor(PROXIMITY_INT_GPIO)
+startup_phase("proximity calibration")
 leds = LEDs(LEDS_GPIO, 5)
+startup_phase("leds")
 screen = Screen()
+startup_phase("oled")
 statistics = Statistics()
+startup_phase("statistics")
+# Threads, CPU, wakeups and memory of the service; served by the exporter and
+# written to stderr on SIGUSR1
+instrumentation = Instrumentation()
+
+def register_pll():
+    # PLL lock is sampled with the statistics when the PLL board and its
+    # library (../pll-software) are present, reading it takes an I2C transfer
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pll-software"))
+    try:
+        from pll import PLL
+        pll = PLL()
+    except (ImportError, OSError):
+        return None
+    statistics.register("pll_locked", pll.locked, ttl=5)
+    return pll
+
+def start_exporter():
+    exporter = MetricsExporter(statistics, port=EXPORTER_PORT, unix_path=EXPORTER_SOCKET)
+    exporter.register_state("screen_awake", lambda: screen.awake)
+    exporter.register_state("screen_panel_on", lambda: screen.panel_on)
+    exporter.register_state("screen_page", lambda: screen.pages[screen.active_page])
+    exporter.register_state("led_effect", lambda: leds.effect if leds.effect_running else "none")
+    exporter.register_state("led_backlight", lambda: leds.backlight_on)
+    exporter.register_state("instrumentation", instrumentation.report)
+    try:
+        return exporter.start()
+    except OSError as error:
+        # e.g. the port is taken, the HAT works fine without the endpoint
+        print(f"Metrics exporter not started: {error}", flush=True)
+        return None
 
 def scroll_left():
     screen.button_scroll_page(-1, 60)
@@ -55,7 +115,9 @@ def turn_off():
     leds.resume(20)
 
 def exit_handler():
-    screen.sleep(0)
+    # Turn the panel off synchronously, a sleep timer would not get to run during exit
+    screen.power_off()
+    screen.flush(1)
     leds.resume(0)
 
 def shutdown():
@@ -82,14 +144,28 @@ if __name__ == '__main__':
     screen.register_statistics(statistics)
 
     atexit.register(exit_handler)
+    instrumentation.start()
+    signal.signal(signal.SIGUSR1, lambda signum, frame: instrumentation.dump())
+    startup_phase("callbacks")
+
+    pll = register_pll()
+    if EXPORTER_PORT is not None or EXPORTER_SOCKET is not None:
+        exporter = start_exporter()
+    startup_phase("exporter")
+    report_startup()
 
     while True:
         time.sleep(1)
-        # Almost everything happens in callbacks, we just need to check the cpu for the high cpu led effect
+        # Almost everything happens in callbacks, we just need to check the cpu for the high cpu led effect.
+        # cpu is the busy percentage of all cores, from /proc/stat
         if not leds.backlight_on and not screen.awake:
+            # Only switch effects, starting one every second would pile up
+            # effect threads on the strip
             if statistics.get("cpu") > 50:
-                leds.start_bounce()
+                if not (leds.effect_running and leds.effect == "bounce"):
+                    leds.start_bounce()
             elif statistics.get("cpu") < 40:
-                leds.start_heartbeat()
+                if not (leds.effect_running and leds.effect == "heartbeat"):
+                    leds.start_heartbeat()
 
     
@@ -0,0 +1,298 @@
+from PIL import Image, ImageDraw, ImageChops
+
+# Declarative page layouts for Screen.  A page is a list of widgets whose
+# geometry is resolved once, when the page is registered; the static parts
+# (labels, lines, paging dots) are drawn into a static layer at the same time,
+# so rendering a page only pastes that layer and draws the dynamic values.
+
+def invert_region(image, xy):
+    # Invert the pixels ImageDraw.rectangle(xy) would fill, in place
+    (x1, y1), (x2, y2) = xy
+    box = (int(x1), int(y1), int(x2)+1, int(y2)+1)
+    image.paste(ImageChops.invert(image.crop(box)), box)
+
+def rounded_rectangle(draw, xy, radius, fill=None, outline=None):
+    x1, y1, x2, y2 = xy
+    if fill:
+        draw.rectangle([(x1, y1 + radius), (x2, y2 - radius)], fill=fill, outline=outline)
+        draw.rectangle([(x1 + radius, y1), (x2 - radius, y2)], fill=fill, outline=outline)
+        draw.ellipse([(x1, y1), (x1 + radius * 2, y1 + radius * 2)], fill=fill, outline=outline)
+        draw.ellipse([(x2 - radius * 2, y2 - radius * 2), (x2, y2)], fill=fill, outline=outline)
+        draw.ellipse([(x1, y2 - radius * 2), (x1 + radius * 2, y2)], fill=fill, outline=outline)
+        draw.ellipse([(x2 - radius * 2, y1), (x2, y1 + radius * 2)], fill=fill, outline=outline)
+    else:
+        draw.line([(x1 + radius, y1), (x2 - radius, y1)], fill=outline)
+        draw.line([(x1 + radius, y2), (x2 - radius, y2)], fill=outline)
+        draw.line([(x1, y1 + radius), (x1, y2 - radius)], fill=outline)
+        draw.line([(x2, y1 + radius), (x2, y2 - radius)], fill=outline)
+        draw.arc((x1, y1, x1 + radius*2, y1 + radius*2), 180, 270, fill=outline)
+        draw.arc((x2 - radius*2, y2 - radius*2, x2, y2), 0, 90, fill=outline)
+        draw.arc((x1, y2 - radius*2, x1 + radius*2, y2), 90, 180, fill=outline)
+        draw.arc((x2 - radius*2, y1, x2, y1 + radius*2), 270, 360, fill=outline)
+
+def paging_dots(draw, width, bottom, number_of_dots, active_dot):
+    single_dot_width = 7
+    middle = width/2
+    dots_width = number_of_dots * single_dot_width
+    for i in range(number_of_dots):
+        fill = 0
+        if i == active_dot:
+            fill = 255
+        draw.ellipse((middle - dots_width/2 + i*single_dot_width + single_dot_width/2, bottom-3, middle - dots_width/2 + i*single_dot_width + single_dot_width/2 + 3, bottom), outline=255, fill=fill)
+
+def align_x(align, width, text_width):
+    if align == "center":
+        return width/2 - text_width/2
+    elif align == "right":
+        return width - text_width
+    return 3
+
+class Widget:
+    # Statistics keys the widget shows, empty for static widgets
+    keys = ()
+    # Box (left, top, right, bottom) the dynamic part is drawn in, set by
+    # resolve() for dynamic widgets
+    region = None
+
+    def collect(self, statistics):
+        # Values of the widget's keys, compared between renders to find the
+        # widgets to redraw, so they have to support ==
+        return {key: statistics.get(key) for key in self.keys}
+
+    def resolve(self, layout, y):
+        # Fix the geometry for the page, returns the cursor below the widget
+        return y
+
+    def draw_static(self, image, draw):
+        pass
+
+    def draw_dynamic(self, image, draw, values):
+        pass
+
+class Rectangle(Widget):
+    # Static filled box, e.g. a page header
+    def __init__(self, xy, fill=255, outline=255):
+        self.xy = xy
+        self.fill = fill
+        self.outline = outline
+
+    def draw_static(self, image, draw):
+        draw.rectangle(self.xy, fill=self.fill, outline=self.outline)
+
+class PagingDots(Widget):
+    # One dot per page along the bottom edge, the page's own dot filled
+    def resolve(self, layout, y):
+        self.width = layout.width
+        self.bottom = layout.height-1
+        self.count = layout.count
+        self.index = layout.index
+        return y
+
+    def draw_static(self, image, draw):
+        paging_dots(draw, self.width, self.bottom, self.count, self.index)
+
+class Label(Widget):
+    # A line of text, either fixed text or the statistic under key.  The line
+    # height is taken from sample, which defaults to a full height glyph, so
+    # the layout does not move with the value.
+    def __init__(self, font, text=None, key=None, align="left", fill=255, margin_top=0, sample="|", format=str):
+        self.font = font
+        self.text = text
+        self.key = key
+        self.keys = () if key is None else (key,)
+        self.align = align
+        self.fill = fill
+        self.margin_top = margin_top
+        self.sample = sample
+        self.format = format
+
+    def resolve(self, layout, y):
+        self.width = layout.width
+        self.y = y + self.margin_top
+        self.height = self.font.size(self.sample)[1]
+        self.region = (0, int(self.y), self.width, int(self.y + self.height) + 1)
+        return self.y + self.height
+
+    def draw_text(self, image, draw, text):
+        x = align_x(self.align, self.width, self.font.size(text)[0])
+        self.font.draw(image, (x, self.y), text, fill=self.fill)
+
+    def draw_static(self, image, draw):
+        if self.key is None:
+            self.draw_text(image, draw, self.text)
+
+    def draw_dynamic(self, image, draw, values):
+        if self.key is not None:
+            self.draw_text(image, draw, self.format(values[self.key]))
+
+class Pill(Label):
+    # Text in a rounded box sized to the text
+    def __init__(self, font, text=None, key=None, align="left", fill=None, outline=255, margin_top=0, sample="|", format=str):
+        super().__init__(font, text, key, align, fill, margin_top, sample, format)
+        self.outline = outline
+
+    def resolve(self, layout, y):
+        y = super().resolve(layout, y)
+        self.region = (0, int(self.y), self.width, int(y + self.height/3) + 1)
+        return y + self.height/3
+
+    def draw_text(self, image, draw, text):
+        text_width = self.font.size(text)[0]
+        x = align_x(self.align, self.width, text_width+12)
+        box_height = self.height + self.height/3
+        rounded_rectangle(draw, (x, self.y, x+text_width+12, self.y+box_height), box_height/2, self.fill, self.outline)
+
+        fill_text = 255
+        if self.fill is not None and self.fill > 0:
+            fill_text = 0
+        self.font.draw(image, (x+7, self.y+self.height/5), text, fill=fill_text)
+
+class Bar(Widget):
+    # Usage bar: label on the left, "value/max unit" on the right and the
+    # used share of the row inverted.  The maximum is fixed (max_value) or
+    # another statistic (max_key); both are multiplied by scale.
+    def __init__(self, font, label, key, unit, max_value=None, max_key=None, scale=1, line=True, margin_top=0):
+        self.font = font
+        self.label = label
+        self.key = key
+        self.max_key = max_key
+        self.keys = (key,) if max_key is None else (key, max_key)
+        self.unit = unit
+        self.max_value = max_value
+        self.scale = scale
+        self.line = line
+        self.margin_top = margin_top
+
+    def value_string(self, value, max_value):
+        if self.unit == "%":
+            return f"{value:.1f}/{max_value:.1f} {self.unit}"
+        percentage = value/max_value*100 if max_value else 0
+        return f"{value:.1f}/{max_value:.1f} {self.unit} ({percentage:.0f}%)"
+
+    def resolve(self, layout, y):
+        self.width = layout.width
+        self.y = y + self.margin_top
+        # Values only differ in their digits, so a zero value has their height
+        self.height = max(self.font.size(self.label)[1], self.font.size(self.value_string(0, 0))[1])
+        # The label is inside the inverted row, so it is redrawn with the value
+        self.region = (0, int(self.y), self.width, int(self.y + self.height) + 3)
+        return self.y + self.height + 6
+
+    def draw_static(self, image, draw):
+        self.font.draw(image, (2, self.y), self.label, fill=255)
+        if self.line:
+            draw.line([(0, self.y + self.height + 4), (self.width, self.y + self.height + 4)], fill=255)
+
+    def draw_dynamic(self, image, draw, values):
+        value = values[self.key]*self.scale
+        max_value = self.max_value if self.max_key is None else values[self.max_key]
+        max_value *= self.scale
+        value_string = self.value_string(value, max_value)
+        value_width = self.font.size(value_string)[0]
+        self.font.draw(image, (self.width-value_width-2, self.y), value_string, fill=255)
+        share = value/max_value if max_value else 0
+        invert_region(image, [(0, self.y), (share*self.width, self.y + self.height + 2)])
+
+class Sparkline(Widget):
+    # Label with a bar graph of the statistic's recent history, one column
+    # per slot of the window.  The graph spans minimum to maximum, which is
+    # fixed, another statistic (max_key) or else the highest value shown.
+    def __init__(self, font, label, key, window=600, minimum=0, maximum=None, max_key=None, height=16, label_width=36, margin_top=0):
+        self.font = font
+        self.label = label
+        self.key = key
+        self.window = window
+        self.minimum = minimum
+        self.maximum = maximum
+        self.max_key = max_key
+        self.series_key = f"{key}/history"
+        self.keys = (self.series_key,) if max_key is None else (self.series_key, max_key)
+        self.height = height
+        self.label_width = label_width
+        self.margin_top = margin_top
+
+    def collect(self, statistics):
+        values = {}
+        if self.max_key is not None:
+            values[self.max_key] = statistics.get(self.max_key)
+        # Statistics without history show an empty graph
+        series = getattr(statistics, "series", None)
+        values[self.series_key] = () if series is None else series(self.key, self.window, self.width - self.label_width)
+        return values
+
+    def resolve(self, layout, y):
+        self.width = layout.width
+        self.y = y + self.margin_top
+        self.bottom = self.y + self.height - 1
+        self.region = (self.label_width, int(self.y), self.width, int(self.bottom) + 1)
+        return self.y + self.height + 3
+
+    def draw_static(self, image, draw):
+        label_height = self.font.size(self.label)[1]
+        self.font.draw(image, (2, self.y + (self.height - label_height)/2), self.label, fill=255)
+        draw.line([(self.label_width, self.bottom), (self.width, self.bottom)], fill=255)
+
+    def draw_dynamic(self, image, draw, values):
+        series = values[self.series_key]
+        maximum = self.maximum
+        if self.max_key is not None and values[self.max_key] is not None:
+            maximum = values[self.max_key]
+        if maximum is None:
+            maximum = max((value for value in series if value is not None), default=self.minimum)
+        span = max(maximum - self.minimum, 1e-9)
+        for column, value in enumerate(series):
+            if value is None:
+                continue
+            share = min(max((value - self.minimum)/span, 0), 1)
+            x = self.label_width + column
+            draw.line([(x, self.bottom), (x, self.bottom - round(share*(self.height - 1)))], fill=255)
+
+class PageLayout:
+    def __init__(self, name, widgets):
+        self.name = name
+        self.widgets = widgets
+        self.keys = []
+        for widget in widgets:
+            for key in widget.keys:
+                if key not in self.keys:
+                    self.keys.append(key)
+        self.dynamic = [widget for widget in widgets if widget.keys]
+        self.static = None
+
+    def collect(self, statistics):
+        values = {}
+        for widget in self.dynamic:
+            values.update(widget.collect(statistics))
+        return values
+
+    def resolve(self, width, height, index, count):
+        # Called whenever pages are added, the paging dots depend on count
+        self.width = width
+        self.height = height
+        self.index = index
+        self.count = count
+        y = 0
+        for widget in self.widgets:
+            y = widget.resolve(self, y)
+        self.static = Image.new('1', (width, height))
+        draw = ImageDraw.Draw(self.static)
+        for widget in self.widgets:
+            widget.draw_static(self.static, draw)
+
+    def render(self, image, draw, values, previous=None):
+        # Draw the page into image.  previous are the values image already
+        # shows this page with, then only the widgets whose values changed are
+        # redrawn.  Returns the regions that were drawn.
+        if previous is None:
+            image.paste(self.static)
+            for widget in self.dynamic:
+                widget.draw_dynamic(image, draw, values)
+            return [(0, 0, self.width, self.height)]
+
+        regions = []
+        for widget in self.dynamic:
+            if any(values[key] != previous[key] for key in widget.keys):
+                image.paste(self.static.crop(widget.region), widget.region)
+                widget.draw_dynamic(image, draw, values)
+                regions.append(widget.region)
+        return regions
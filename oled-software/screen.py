@@ -5,26 +5,45 @@ import sys
 import subprocess
 import threading
 import numbers
+import traceback
+from collections import OrderedDict
 from multiprocessing import Queue
-import RPi.GPIO as GPIO
 from threading import Timer, Thread
 
-from board import SCL, SDA
-import busio
 from PIL import Image, ImageDraw, ImageFont, ImageChops
 from ssd1306 import SSD1306_128_64
+from glyph_atlas import GlyphAtlas, default_cache_dir
+from page_layout import PageLayout, Rectangle, PagingDots, Label, Bar, Sparkline, invert_region, rounded_rectangle, paging_dots
+
+# Characters of the numbers shown on the pages
+NUMBER_CHARACTERS = "0123456789./%GB() "
+
+# Default of Screen's font_cache_dir, None already turns the cache off
+DEFAULT_CACHE_DIR = object()
 
 class Screen:
-    def __init__(self):
-        self.pages = ["identification", "usage"]
+    def __init__(self, display=None, font_cache_dir=DEFAULT_CACHE_DIR):
+        # Page names in paging order, see register_page()
+        self.pages = []
+        self.layouts = {}
         self.active_page = 0
         self.scroll_timer = None
         self.sleep_timer = None
         self.sleep_timeout = 20
+        # While awake the visible page is redrawn every refresh_interval
+        # seconds when its statistics changed, None turns this off
+        self.refresh_interval = 1
+        # One refresh thread while awake, it ends once refresh_stop is set
+        self.refresh_thread = None
+        self.refresh_stop = threading.Event()
         self.statistics = None
         self.awake = False
 
-        self.display = SSD1306_128_64(rst=None)
+        # Send frames in as few I2C transactions as the adapter allows.
+        # A display can be passed in instead, e.g. a virtual one for testing.
+        self.display = display
+        if self.display is None:
+            self.display = SSD1306_128_64(rst=None, i2c_chunk_size=None)
         self.display.begin()
 
         # Clear display.
@@ -33,10 +52,25 @@ class Screen:
 
         self.width = self.display.width
         self.height = self.display.height
-        self.image = Image.new('1', (self.width, self.height))
+        # Front and back canvases, each with its packed display frame.
+        # Rendering always targets the back canvas (self.image) and packs it
+        # into the back frame, show() publishes that frame to the writer
+        # thread and swaps the two, so the renderer never shares a buffer
+        # with a frame being transmitted.
+        self.canvases = [Image.new('1', (self.width, self.height)) for _ in range(2)]
+        self.packed = [bytearray(self.width*self.height//8) for _ in range(2)]
+        self.back = 0
+        self.image = self.canvases[self.back]
 
         # Get drawing object to draw on image.
         self.draw = ImageDraw.Draw(self.image)
+        # (page, statistics) each canvas shows, None when unknown, so a page
+        # can be redrawn on a canvas by only updating the widgets that changed
+        self.canvas_values = [None, None]
+        # (page, statistics) of the page drawn last
+        self.page_values = None
+        # Serializes rendering threads (buttons, timers) on the back canvas
+        self.render_lock = threading.RLock()
 
         self.top = 0
         self.bottom = self.height-1
@@ -44,66 +78,200 @@ class Screen:
         self.cursor_x = 0
         self.cursor_y = 0
 
+        # Rendered pages are cached as packed display frames keyed by page
+        # name and the statistics the page shows, 0 turns the cache off.
+        self.frame_cache = OrderedDict()
+        self.frame_cache_size = 8
+        # Packed frame of the page drawn last, None when self.image is newer
+        self.frame = None
+
         # Load default font.
         #font = ImageFont.load_default()
-        self.font_small = ImageFont.truetype('OpenSans-SemiBold.ttf', 9)
-        self.font_medium = ImageFont.truetype('OpenSans-SemiBold.ttf', 11)
-        self.font_large = ImageFont.truetype('OpenSans-ExtraBold.ttf', 13)
-
+        # Text is drawn from per-font glyph atlases, preloaded with what the
+        # pages show; hostname characters are added in register_statistics.
+        # The fonts themselves are only loaded when a glyph is missing from
+        # the glyph cache in font_cache_dir (None disables the cache).
+        if font_cache_dir is DEFAULT_CACHE_DIR:
+            # Looked up per Screen, so XDG_CACHE_HOME set after import counts
+            font_cache_dir = default_cache_dir()
+        self.font_small = GlyphAtlas.truetype('OpenSans-SemiBold.ttf', 9, preload=NUMBER_CHARACTERS, cache_dir=font_cache_dir)
+        self.font_medium = GlyphAtlas.truetype('OpenSans-SemiBold.ttf', 11, preload=NUMBER_CHARACTERS + "CPURAMDISK", cache_dir=font_cache_dir)
+        self.font_large = GlyphAtlas.truetype('OpenSans-ExtraBold.ttf', 13, cache_dir=font_cache_dir)
+
+        self.register_page(PageLayout("identification", [
+            PagingDots(),
+            Rectangle([(0, 0), (self.width, self.height/2-5)], fill=255, outline=255),
+            Label(self.font_large, key="hostname", align="center", fill=0, margin_top=self.height/4-12),
+            Label(self.font_small, key="ip", align="center", fill=255, margin_top=self.height/4+4),
+        ]))
+        self.register_page(PageLayout("usage", [
+            PagingDots(),
+            Bar(self.font_medium, "CPU", "cpu", "%", max_value=100),
+            Bar(self.font_medium, "RAM", "ram", "GB", max_key="ram_max", scale=1/1024),
+            Bar(self.font_medium, "DISK", "disk", "GB", max_key="disk_max", line=False),
+        ]))
+        # The last ten minutes of the statistics that keep a history
+        self.register_page(PageLayout("history", [
+            PagingDots(),
+            Sparkline(self.font_small, "CPU", "cpu", maximum=100, margin_top=1),
+            Sparkline(self.font_small, "RAM", "ram", max_key="ram_max"),
+            Sparkline(self.font_small, "TEMP", "temperature", minimum=30, maximum=90),
+        ]))
+
+        # A single writer thread owns the display, show() only publishes the
+        # newest frame into a one-slot mailbox; frames that are replaced
+        # before the writer picks them up are dropped.
+        self.frame_condition = threading.Condition()
+        self.pending_frame = None
+        # Requested panel power state, applied by the writer after the frame
+        self.pending_power = None
+        self.panel_on = True
+        self.writing = False
+        self.frames_submitted = 0
+        self.frames_transmitted = 0
+        self.frames_dropped = 0
+        # Page transitions: "scroll" slides the old page out using the
+        # controller's hardware scroll before the new page is written,
+        # "none" switches pages immediately.  The fastest hardware scroll
+        # moves one column every 2 panel frames, about 50 columns a second
+        # at the default oscillator, so sliding a whole page out would take
+        # over 2 s; the slide only shifts transition_columns columns as a
+        # hint of the direction before the new page replaces it.
+        self.transition_mode = "scroll"
+        self.transition_frames = 2
+        self.transition_rate = 50
+        self.transition_columns = 16
+        self.writer_thread = Thread(target=self.write_frames, daemon=True)
+        self.writer_thread.start()
+
+        # Start out asleep, with a blank frame in the display RAM
         self.clear()
+        self.power_off()
         
     def clear(self, write = True, for_sleep = False):
-        self.display.clear()
-        # Draw a black filled box to clear the image.
-        self.draw.rectangle((0, 0, self.width, self.height), outline=0, fill=0)
-        if write:
-            self.display.display()
+        with self.render_lock:
+            # Draw a black filled box to clear the image.
+            self.draw.rectangle((0, 0, self.width, self.height), outline=0, fill=0)
+            self.canvas_values[self.back] = None
+            self.page_values = None
+            self.frame = None
+            if write:
+                self.show()
         self.cursor_y = 0
         self.cursor_x = 0
         if for_sleep:
             if self.scroll_timer is not None:
                 self.scroll_timer.cancel()
+            self.cancel_refresh()
             self.awake = False
 
-    def show(self):
-        self.display.image(self.image)
-        show_thread = Thread(target=self.display.display)
-        show_thread.start()
+    def show(self, transition=None):
+        # transition is the page scroll direction, None shows the frame as is
+        if self.transition_mode != "scroll":
+            transition = None
+        with self.render_lock:
+            frame = self.frame
+            if frame is None:
+                frame = self.display.pack(self.image, self.packed[self.back])
+            with self.frame_condition:
+                if self.pending_frame is not None:
+                    self.frames_dropped += 1
+                self.pending_frame = (frame, transition)
+                self.frames_submitted += 1
+                self.swap()
+                self.frame_condition.notify_all()
+
+    def swap(self):
+        # Called with frame_condition held: the old front is neither pending
+        # nor being copied by the writer, so it is free to draw on again
+        self.back = 1 - self.back
+        self.image = self.canvases[self.back]
+        self.draw = ImageDraw.Draw(self.image)
+        self.frame = None
+
+    def write_frames(self):
+        while True:
+            with self.frame_condition:
+                while self.pending_frame is None and self.pending_power is None:
+                    self.frame_condition.wait()
+                pending = self.pending_frame
+                power = self.pending_power
+                self.pending_frame = None
+                self.pending_power = None
+                self.writing = True
+                if pending is not None:
+                    # Take the frame over while locked, its buffer becomes the
+                    # renderer's back buffer again after the next swap
+                    self.display.buffer[:] = pending[0]
+            transmitted = False
+            try:
+                if pending is not None:
+                    if pending[1] is not None and self.panel_on:
+                        self.transition(pending[1])
+                    # Frames identical to the panel contents send nothing
+                    self.display.display()
+                    transmitted = True
+                if power is not None and power != self.panel_on:
+                    # A single command byte, the display RAM is kept
+                    if power:
+                        self.display.power_on()
+                    else:
+                        self.display.power_off()
+                    self.panel_on = power
+            except Exception:
+                # Keep the writer alive, the next frame may well get through
+                traceback.print_exc()
+            with self.frame_condition:
+                self.writing = False
+                if transmitted:
+                    self.frames_transmitted += 1
+                self.frame_condition.notify_all()
+
+    def transition(self, direction):
+        # Slide the current contents out, a newer frame cuts the slide short
+        duration = self.transition_columns/self.transition_rate
+        self.display.start_scroll(-direction, self.transition_frames)
+        try:
+            with self.frame_condition:
+                self.frame_condition.wait_for(lambda: self.pending_frame is not None, duration)
+        finally:
+            self.display.stop_scroll()
+
+    def flush(self, timeout=None):
+        # Wait until the newest frame has been written to the display
+        with self.frame_condition:
+            return self.frame_condition.wait_for(lambda: self.pending_frame is None and self.pending_power is None and not self.writing, timeout)
+
+    def request_power(self, on):
+        with self.frame_condition:
+            self.pending_power = on
+            self.frame_condition.notify_all()
+
+    def power_off(self):
+        # Sleep: stop scrolling and turn the panel off, keeping its contents
+        if self.scroll_timer is not None:
+            self.scroll_timer.cancel()
+        self.cancel_refresh()
+        self.awake = False
+        self.request_power(False)
+
+    def power_on(self):
+        self.request_power(True)
+
+    def frame_counters(self):
+        with self.frame_condition:
+            return {"submitted": self.frames_submitted, "transmitted": self.frames_transmitted, "dropped": self.frames_dropped}
 
     def draw_paging_dots(self, number_of_dots, active_dot):
-        single_dot_width = 7
-        middle = self.width/2
-        dots_width = number_of_dots * single_dot_width
-        for i in range(number_of_dots):
-            fill = 0
-            if i == active_dot:
-                fill = 255
-            self.draw.ellipse((middle - dots_width/2 + i*single_dot_width + single_dot_width/2, self.bottom-3, middle - dots_width/2 + i*single_dot_width + single_dot_width/2 + 3, self.bottom), outline=255, fill=fill)
+        paging_dots(self.draw, self.width, self.bottom, number_of_dots, active_dot)
 
     def draw_rounded_rectangle(self, xy, radius, fill=None, outline=None):
-        # Draw the rounded rectangle
-        x1, y1, x2, y2 = xy
-        if fill:
-            self.draw.rectangle([(x1, y1 + radius), (x2, y2 - radius)], fill=fill, outline=outline)
-            self.draw.rectangle([(x1 + radius, y1), (x2 - radius, y2)], fill=fill, outline=outline)
-            self.draw.ellipse([(x1, y1), (x1 + radius * 2, y1 + radius * 2)], fill=fill, outline=outline)
-            self.draw.ellipse([(x2 - radius * 2, y2 - radius * 2), (x2, y2)], fill=fill, outline=outline)
-            self.draw.ellipse([(x1, y2 - radius * 2), (x1 + radius * 2, y2)], fill=fill, outline=outline)
-            self.draw.ellipse([(x2 - radius * 2, y1), (x2, y1 + radius * 2)], fill=fill, outline=outline)
-        else:
-            self.draw.line([(x1 + radius, y1), (x2 - radius, y1)], fill=outline)
-            self.draw.line([(x1 + radius, y2), (x2 - radius, y2)], fill=outline)
-            self.draw.line([(x1, y1 + radius), (x1, y2 - radius)], fill=outline)
-            self.draw.line([(x2, y1 + radius), (x2, y2 - radius)], fill=outline)
-            self.draw.arc((x1, y1, x1 + radius*2, y1 + radius*2), 180, 270, fill=outline)
-            self.draw.arc((x2 - radius*2, y2 - radius*2, x2, y2), 0, 90, fill=outline)
-            self.draw.arc((x1, y2 - radius*2, x1 + radius*2, y2), 90, 180, fill=outline)
-            self.draw.arc((x2 - radius*2, y1, x2, y1 + radius*2), 270, 360, fill=outline)
+        rounded_rectangle(self.draw, xy, radius, fill, outline)
 
     def draw_pill_text(self, align, text, font=None, fill=None, outline=None, margin_top=0):
         if font is None:
             font = self.font_medium
-        text_width, text_height = self.draw.textsize(text, font=font)
+        text_width, text_height = font.size(text)
 
         y = self.cursor_y + margin_top
 
@@ -118,14 +286,14 @@ class Screen:
         fill_text = 255
         if fill is not None and fill > 0:
             fill_text = 0
-        self.draw.text((x+7, y+text_height/5), text,  font=font, fill=fill_text)
+        font.draw(self.image, (x+7, y+text_height/5), text, fill=fill_text)
 
         self.cursor_y = y + y+text_height+text_height/3
 
     def draw_text(self, align, text, font=None, fill=None, outline=None, margin_top=0):
         if font is None:
             font = self.font_medium
-        text_width, text_height = self.draw.textsize(text, font=font)
+        text_width, text_height = font.size(text)
 
         x = 3
         if align == "center":
@@ -134,7 +302,7 @@ class Screen:
             x = self.width - (text_width)
 
         y = self.cursor_y + margin_top
-        self.draw.text((x, y), text, font=font, fill=fill, outline=outline)
+        font.draw(self.image, (x, y), text, fill=fill)
         self.cursor_y = y + text_height
 
     def draw_bar(self, text, value, max_value, unit, font=None, line=True, margin_top=0):
@@ -146,42 +314,96 @@ class Screen:
             value_string = f"{value:.1f}/{max_value:.1f} {unit}"
         else:
             value_string = f"{value:.1f}/{max_value:.1f} {unit} ({percentage:.0f}%)"
-        text_width, text_height = self.draw.textsize(text, font=font)
-        value_width, value_height = self.draw.textsize(value_string, font=font)
-        self.draw.text((self.cursor_x+2, self.cursor_y), text, font=font, fill=255, outline=0)
-        self.draw.text((self.width-value_width-2, self.cursor_y), value_string, font=font, fill=255, outline=0)
+        text_width, text_height = font.size(text)
+        value_width, value_height = font.size(value_string)
+        font.draw(self.image, (self.cursor_x+2, self.cursor_y), text, fill=255)
+        font.draw(self.image, (self.width-value_width-2, self.cursor_y), value_string, fill=255)
         if line:
             self.draw.line([(0, max(text_height, value_height) + self.cursor_y + 4), (self.width, max(text_height, value_height) + self.cursor_y + 4)], fill=255)
 
-        graphs = Image.new('1', (self.width, self.height))
-        draw_graphs = ImageDraw.Draw(graphs)
-        draw_graphs.rectangle([(0, self.cursor_y), (percentage/100*self.width, self.cursor_y + max(text_height, value_height) + 2)], fill=255, outline=255)
-        graphs = ImageChops.logical_xor(self.image, graphs)
-
-        self.image.paste(graphs, (0,0))
+        self.invert_region([(0, self.cursor_y), (percentage/100*self.width, self.cursor_y + max(text_height, value_height) + 2)])
         self.cursor_y = max(text_height, value_height) + self.cursor_y + 6
 
+    def invert_region(self, xy):
+        invert_region(self.image, xy)
+
+    def register_page(self, layout, position=None):
+        # Add a page, its geometry and static parts are resolved here once
+        with self.render_lock:
+            if position is None:
+                position = len(self.pages)
+            self.pages.insert(position, layout.name)
+            self.layouts[layout.name] = layout
+            # Every page's paging dots change with the number of pages
+            for index, name in enumerate(self.pages):
+                self.layouts[name].resolve(self.width, self.height, index, len(self.pages))
+            self.frame_cache.clear()
+            self.canvas_values = [None, None]
+
     def draw_page(self, page):
+        key = self.render_page(page)
+        if key is not None:
+            self.pack_page(key)
+
+    def render_page(self, page):
+        # Draw the page onto the back canvas.  Returns the cache key of the
+        # frame to pack, None when there is nothing to pack: a cache hit set
+        # self.frame already, or there are no statistics to show.
         if isinstance(page, numbers.Number):
             page = self.pages[page]
 
-        self.clear(False)
-
-        if self.statistics is not None:
-            if page == "identification":
-                self.draw_paging_dots(len(self.pages), 0)
-                self.draw.rectangle([(0, 0), (self.width, self.height/2-5)], fill=255, outline=255)
-                self.draw_text("center", self.statistics.get("hostname"), font=self.font_large, fill=0, margin_top=self.height/4-12)
-                self.draw_text("center", self.statistics.get("ip"), font=self.font_small, fill=255, margin_top=self.height/4+4)
-            elif page == "usage":
-                self.draw_paging_dots(len(self.pages), 1)
-                self.draw_bar("CPU", self.statistics.get("cpu"), 100, "%", font=self.font_medium,)
-                self.draw_bar("RAM", self.statistics.get("ram")/1024, self.statistics.get("ram_max")/1024, "GB", font=self.font_medium,)
-                self.draw_bar("DISK", self.statistics.get("disk"), self.statistics.get("disk_max"), "GB", font=self.font_medium, line=False)
-                
+        if self.statistics is None:
+            self.clear(False)
+            return None
+
+        layout = self.layouts[page]
+        values = layout.collect(self.statistics)
+        key = (page, tuple(values.values()))
+        self.page_values = (page, values)
+        if key in self.frame_cache:
+            # Cache hit, self.image is left as is and only the frame is used
+            self.frame_cache.move_to_end(key)
+            self.frame = self.frame_cache[key]
+            return None
+
+        # Only redraw what changed when the canvas already shows this page
+        previous = self.canvas_values[self.back]
+        if previous is not None and previous[0] == page:
+            layout.render(self.image, self.draw, values, previous[1])
+        else:
+            layout.render(self.image, self.draw, values)
+        self.canvas_values[self.back] = (page, values)
+        self.frame = None
+        return key
+
+    def pack_page(self, key):
+        # Pack the rendered back canvas into its frame buffer and cache it
+        self.frame = self.display.pack(self.image, self.packed[self.back])
+        self.cache_frame(key, self.frame)
+
+    def cache_frame(self, key, frame):
+        # The back frame is packed into again after the next swap, the cache
+        # keeps its own copy.  Once the cache is full the evicted entry's
+        # buffer takes the copy, unless that entry is still waiting for the
+        # writer, so a full cache allocates nothing.
+        if not self.frame_cache_size:
+            return
+        entry = None
+        if len(self.frame_cache) >= self.frame_cache_size:
+            _, entry = self.frame_cache.popitem(last=False)
+            with self.frame_condition:
+                if self.pending_frame is not None and self.pending_frame[0] is entry:
+                    entry = None
+        if entry is None:
+            entry = bytearray(frame)
+        else:
+            entry[:] = frame
+        self.frame_cache[key] = entry
+
     def start_scroll_page(self, timeout = 10):
-        self.draw_page(self.active_page)
-        self.show()
+        with self.render_lock:
+            self.draw_page(self.active_page)
+            self.show()
         self.scroll_timer = Timer(timeout, self.loop_scroll_page, [timeout])
         self.scroll_timer.start()
 
@@ -191,13 +413,50 @@ class Screen:
         self.scroll_timer.start()
 
     def scroll_page(self, direction):
-        self.active_page = (self.active_page + 1) % len(self.pages)
-        self.draw_page(self.active_page)
-        self.show()
+        with self.render_lock:
+            # direction is +1 for the next page and -1 for the previous one,
+            # the old page slides out the opposite way
+            self.active_page = (self.active_page + direction) % len(self.pages)
+            self.draw_page(self.active_page)
+            self.show(direction)
+
+    def refresh_page(self):
+        # Redraw the visible page if its statistics changed.  The display
+        # only transmits the parts of the frame that differ from the panel,
+        # so a changed value costs the bytes of its widget.
+        with self.render_lock:
+            if self.statistics is None:
+                return
+            shown = self.page_values
+            self.draw_page(self.active_page)
+            if self.page_values != shown:
+                self.show()
+
+    def start_refresh(self):
+        if not self.refresh_interval:
+            return
+        if self.refresh_thread is not None and self.refresh_thread.is_alive() and not self.refresh_stop.is_set():
+            return
+        # Each thread gets its own event, so a cancelled thread that is still
+        # finishing a refresh never picks up again
+        self.refresh_stop = threading.Event()
+        self.refresh_thread = Thread(target=self.loop_refresh, args=(self.refresh_stop,), daemon=True)
+        self.refresh_thread.start()
+
+    def loop_refresh(self, stop):
+        while not stop.wait(self.refresh_interval):
+            if not self.awake:
+                return
+            self.refresh_page()
+
+    def cancel_refresh(self):
+        self.refresh_stop.set()
 
     def button_scroll_page(self, direction, timeout):
         self.awake = True
         self.scroll_page(direction)
+        self.power_on()
+        self.start_refresh()
         if self.scroll_timer is not None:
         	self.scroll_timer.cancel()
         if self.sleep_timer is not None:
@@ -209,6 +468,13 @@ class Screen:
 
     def register_statistics(self, statistics):
         self.statistics = statistics
+        self.font_large.preload(str(statistics.get("hostname")))
+        self.save_font_cache()
+
+    def save_font_cache(self):
+        # Everything the pages show is rasterized by now
+        for font in (self.font_small, self.font_medium, self.font_large):
+            font.save_cache()
 
     def sleep(self, timeout=20):
         self.sleep_timeout = timeout
@@ -216,11 +482,13 @@ class Screen:
         if self.awake:
             if self.sleep_timer is not None:
                 self.sleep_timer.cancel()
-            self.sleep_timer = Timer(self.sleep_timeout, self.clear, [True, True])
+            self.sleep_timer = Timer(self.sleep_timeout, self.power_off)
             self.sleep_timer.start()
 
 
     def wake(self):
         if not self.awake:
             self.awake = True
-            self.start_scroll_page()
\ No newline at end of file
+            self.start_scroll_page()
+            self.power_on()
+            self.start_refresh()
\ No newline at end of file
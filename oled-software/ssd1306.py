@@ -24,10 +24,12 @@ import time
 
 import Adafruit_GPIO as GPIO
 import Adafruit_GPIO.SPI as SPI
+from PIL import Image
 
 
 # Constants
 SSD1306_I2C_ADDRESS = 0x3C    # 011110+SA0+RW - 0x3C or 0x3D
+SSD1306_I2C_MAX_CHUNK = 8192  # Largest write the Linux i2c-dev driver accepts
 SSD1306_SETCONTRAST = 0x81
 SSD1306_DISPLAYALLON_RESUME = 0xA4
 SSD1306_DISPLAYALLON = 0xA5
@@ -62,6 +64,9 @@ SSD1306_RIGHT_HORIZONTAL_SCROLL = 0x26
 SSD1306_LEFT_HORIZONTAL_SCROLL = 0x27
 SSD1306_VERTICAL_AND_RIGHT_HORIZONTAL_SCROLL = 0x29
 SSD1306_VERTICAL_AND_LEFT_HORIZONTAL_SCROLL = 0x2A
+# Scroll step interval in frames and its command encoding
+SSD1306_SCROLL_INTERVALS = {2: 0x07, 3: 0x04, 4: 0x05, 5: 0x00, 25: 0x06,
+                            64: 0x01, 128: 0x02, 256: 0x03}
 
 
 class SSD1306Base(object):
@@ -71,14 +76,45 @@ class SSD1306Base(object):
 
     def __init__(self, width, height, rst, dc=None, sclk=None, din=None, cs=None,
                  gpio=None, spi=None, i2c_bus=None, i2c_address=SSD1306_I2C_ADDRESS,
-                 i2c=None):
+                 i2c=None, i2c_chunk_size=16):
         self._log = logging.getLogger('Adafruit_SSD1306.SSD1306Base')
         self._spi = None
         self._i2c = None
         self.width = width
         self.height = height
         self._pages = height//8
-        self._buffer = [0]*(width*self._pages)
+        # Preallocated frame buffers, all per-frame work happens in place on
+        # these through their memoryviews.
+        self._buffer = bytearray(width*self._pages)
+        self._view = memoryview(self._buffer)
+        self._blank = bytes(width*self._pages)
+        # Frame that was last written to the display, only meaningful while
+        # _last_frame_valid is True.
+        self._last_frame = bytearray(width*self._pages)
+        self._last_view = memoryview(self._last_frame)
+        self._last_frame_valid = False
+        # Addressing commands sent ahead of every window, see _set_window().
+        self._window_commands = bytearray([SSD1306_COLUMNADDR, 0, width-1,
+                                           SSD1306_PAGEADDR, 0, self._pages-1])
+        # Fraction of the frame above which display() sends a full frame
+        # instead of only the changed windows.
+        self.partial_threshold = 0.5
+        # Number of data bytes per I2C transaction, None sends every window
+        # as a single transaction of at most SSD1306_I2C_MAX_CHUNK bytes.
+        if i2c_chunk_size is None:
+            i2c_chunk_size = SSD1306_I2C_MAX_CHUNK
+        if i2c_chunk_size < 1 or i2c_chunk_size > SSD1306_I2C_MAX_CHUNK:
+            raise ValueError('I2C chunk size must be a value from 1 to {0} (inclusive).' \
+                .format(SSD1306_I2C_MAX_CHUNK))
+        self._i2c_chunk_size = i2c_chunk_size
+        # Transfer statistics, see frame_rate().
+        self.frames = 0
+        self.transfer_time = 0.0
+        # Precompute where each page lives in the packed column-major bytes
+        # produced by image(), see image() for the layout.
+        self._page_slices = [(slice(page*width, (page+1)*width),
+                              slice(self._pages-1-page, None, self._pages))
+                             for page in range(self._pages)]
         # Default to platform GPIO if not provided.
         self._gpio = gpio
         if self._gpio is None:
@@ -117,6 +153,11 @@ class SSD1306Base(object):
     def _initialize(self):
         raise NotImplementedError
 
+    @property
+    def buffer(self):
+        """Memoryview of the display buffer in SSD1306 page order."""
+        return self._view
+
     def command(self, c):
         """Send command byte to display."""
         if self._spi is not None:
@@ -128,6 +169,17 @@ class SSD1306Base(object):
             control = 0x00   # Co = 0, DC = 0
             self._i2c.write8(control, c)
 
+    def commands(self, sequence):
+        """Send a sequence of command bytes to display in a single transfer."""
+        if self._spi is not None:
+            # SPI write.
+            self._gpio.set_low(self._dc)
+            self._spi.write(sequence)
+        else:
+            # I2C write, a single control byte followed by all command bytes.
+            control = 0x00   # Co = 0, DC = 0
+            self._i2c.writeList(control, sequence)
+
     def data(self, c):
         """Send byte of data to display."""
         if self._spi is not None:
@@ -146,6 +198,8 @@ class SSD1306Base(object):
         # Reset and initialize display.
         self.reset()
         self._initialize()
+        # Display RAM contents are unknown after initialization.
+        self._last_frame_valid = False
         # Turn on the display.
         self.command(SSD1306_DISPLAYON)
 
@@ -162,63 +216,164 @@ class SSD1306Base(object):
         # Set reset high again.
         self._gpio.set_high(self._rst)
 
-    def display(self):
-        """Write display buffer to physical display."""
-        self.command(SSD1306_COLUMNADDR)
-        self.command(0)              # Column start address. (0 = reset)
-        self.command(self.width-1)   # Column end address.
-        self.command(SSD1306_PAGEADDR)
-        self.command(0)              # Page start address. (0 = reset)
-        self.command(self._pages-1)  # Page end address.
-        # Write buffer data.
+    def _set_window(self, column_start, column_end, page_start, page_end):
+        """Restrict the following data writes to the given column and page
+        range (inclusive)."""
+        window = self._window_commands
+        window[1] = column_start     # Column start address.
+        window[2] = column_end       # Column end address.
+        window[4] = page_start       # Page start address.
+        window[5] = page_end         # Page end address.
+        self.commands(window)
+
+    def _write_data(self, data):
+        """Write a run of data bytes into the current window.  Slices of a
+        memoryview are passed on as is, so no copies of the frame are made.
+        """
         if self._spi is not None:
             # Set DC high for data.
             self._gpio.set_high(self._dc)
             # Write buffer.
-            self._spi.write(self._buffer)
+            self._spi.write(data)
         else:
-            for i in range(0, len(self._buffer), 16):
-                control = 0x40   # Co = 0, DC = 0
-                self._i2c.writeList(control, self._buffer[i:i+16])
+            control = 0x40   # Co = 0, DC = 1
+            chunk = self._i2c_chunk_size
+            for i in range(0, len(data), chunk):
+                self._i2c.writeList(control, data[i:i+chunk])
+
+    def _dirty_windows(self):
+        """Return a (page, first column, last column) window for every page
+        that differs from the last frame written to the display, or None when
+        a full frame write is cheaper.
+        """
+        if not self._last_frame_valid:
+            return None
+        windows = []
+        cost = 0
+        for page in range(self._pages):
+            start = page*self.width
+            new = self._view[start:start+self.width]
+            old = self._last_view[start:start+self.width]
+            if new == old:
+                continue
+            first = next(x for x in range(self.width) if new[x] != old[x])
+            last = next(x for x in range(self.width-1, first-1, -1) if new[x] != old[x])
+            windows.append((page, first, last))
+            # Every window costs six address command bytes on top of its data.
+            cost += last - first + 1 + 6
+        if cost > self.partial_threshold*len(self._buffer):
+            return None
+        return windows
+
+    def display(self, full=False):
+        """Write display buffer to physical display.  Only the column spans of
+        the pages that changed since the previous write are sent, unless full
+        is True or the changes cover more than partial_threshold of the frame.
+        """
+        start_time = time.time()
+        windows = None if full else self._dirty_windows()
+        # Until every window is written the panel contents are unknown, a
+        # failed write makes the next display() send the full frame.
+        self._last_frame_valid = False
+        if windows is None:
+            self._set_window(0, self.width-1, 0, self._pages-1)
+            self._write_data(self._view)
+        else:
+            for page, first, last in windows:
+                start = page*self.width
+                self._set_window(first, last, page, page)
+                self._write_data(self._view[start+first:start+last+1])
+        self._last_frame[:] = self._buffer
+        self._last_frame_valid = True
+        self.frames += 1
+        self.transfer_time += time.time() - start_time
+
+    def frame_rate(self):
+        """Return the achieved frame rate in frames per second, measured over
+        the time spent inside display() since construction.
+        """
+        if self.transfer_time <= 0:
+            return 0.0
+        return self.frames/self.transfer_time
 
     def image(self, image):
         """Set buffer to value of Python Imaging Library image.  The image should
         be in 1 bit mode and a size equal to the display size.
         """
+        self.pack(image, self._view)
+
+    def pack(self, image, buffer=None):
+        """Convert a Python Imaging Library image to the display buffer format
+        without touching the display buffer.  The result is written into buffer
+        when given, otherwise into a new bytearray, and returned.  Pillow has
+        no way to pack an image into an existing buffer, so every call still
+        makes a transposed copy of the image and tobytes() a 64 KB encoder
+        block that is freed again right away.
+        """
         if image.mode != '1':
             raise ValueError('Image must be in mode 1.')
         imwidth, imheight = image.size
         if imwidth != self.width or imheight != self.height:
             raise ValueError('Image must be same dimensions as display ({0}x{1}).' \
                 .format(self.width, self.height))
-        # Grab all the pixels from the image, faster than getpixel.
-        pix = image.load()
-        # Iterate through the memory pages
-        index = 0
-        for page in range(self._pages):
-            # Iterate through all x axis columns.
-            for x in range(self.width):
-                # Set the bits for the column of pixels at the current position.
-                bits = 0
-                # Don't use range here as it's a bit slow
-                for bit in [0, 1, 2, 3, 4, 5, 6, 7]:
-                    bits = bits << 1
-                    bits |= 0 if pix[(x, page*8+7-bit)] == 0 else 1
-                # Update buffer byte and increment to next byte.
-                self._buffer[index] = bits
-                index += 1
+        if buffer is None:
+            buffer = bytearray(self.width*self._pages)
+        view = memoryview(buffer)
+        # Rotating clockwise turns every display column into an image row that
+        # runs bottom to top, so tobytes() packs each column as one byte per
+        # page with the top pixel in the LSB, exactly like the SSD1306 GDDRAM.
+        # The packed rows are ordered last page first, so only a page-wise
+        # regroup of the bytes is left to do.
+        data = memoryview(image.transpose(Image.ROTATE_270).tobytes())
+        for page, column in self._page_slices:
+            view[page] = data[column]
+        return buffer
 
     def clear(self):
         """Clear contents of image buffer."""
-        self._buffer = [0]*(self.width*self._pages)
+        self._buffer[:] = self._blank
+
+    def power_off(self):
+        """Put the display to sleep.  The panel and its charge pump are turned
+        off while the display RAM keeps its contents."""
+        self.command(SSD1306_DISPLAYOFF)
+
+    def power_on(self):
+        """Wake the display, showing the contents of the display RAM."""
+        self.command(SSD1306_DISPLAYON)
+
+    def start_scroll(self, direction, frames=2, start_page=0, end_page=None):
+        """Let the controller scroll the displayed pages horizontally, one
+        column every frames frames.  Direction is -1 to scroll left and 1 to
+        scroll right.  The contents of the display RAM are undefined once the
+        scroll is stopped, so the next display() writes a full frame.
+        """
+        if frames not in SSD1306_SCROLL_INTERVALS:
+            raise ValueError('Scroll interval must be one of {0} frames.' \
+                .format(sorted(SSD1306_SCROLL_INTERVALS)))
+        if end_page is None:
+            end_page = self._pages-1
+        if direction < 0:
+            scroll = SSD1306_LEFT_HORIZONTAL_SCROLL
+        else:
+            scroll = SSD1306_RIGHT_HORIZONTAL_SCROLL
+        self._last_frame_valid = False
+        # A running scroll must be stopped before it can be reconfigured.
+        self.commands([SSD1306_DEACTIVATE_SCROLL,
+                       scroll, 0x00, start_page, SSD1306_SCROLL_INTERVALS[frames],
+                       end_page, 0x00, 0xFF,
+                       SSD1306_ACTIVATE_SCROLL])
+
+    def stop_scroll(self):
+        """Stop a scroll started with start_scroll()."""
+        self.command(SSD1306_DEACTIVATE_SCROLL)
 
     def set_contrast(self, contrast):
         """Sets the contrast of the display.  Contrast should be a value between
         0 and 255."""
         if contrast < 0 or contrast > 255:
             raise ValueError('Contrast must be a value from 0 to 255 (inclusive).')
-        self.command(SSD1306_SETCONTRAST)
-        self.command(contrast)
+        self.commands([SSD1306_SETCONTRAST, contrast])
 
     def dim(self, dim):
         """Adjusts contrast to dim the display if dim is True, otherwise sets the
@@ -237,127 +392,88 @@ class SSD1306Base(object):
 class SSD1306_128_64(SSD1306Base):
     def __init__(self, rst, dc=None, sclk=None, din=None, cs=None, gpio=None,
                  spi=None, i2c_bus=None, i2c_address=SSD1306_I2C_ADDRESS,
-                 i2c=None):
+                 i2c=None, i2c_chunk_size=16):
         # Call base class constructor.
         super(SSD1306_128_64, self).__init__(128, 64, rst, dc, sclk, din, cs,
-                                             gpio, spi, i2c_bus, i2c_address, i2c)
+                                             gpio, spi, i2c_bus, i2c_address, i2c,
+                                             i2c_chunk_size)
 
     def _initialize(self):
-        # 128x64 pixel specific initialization.
-        self.command(SSD1306_DISPLAYOFF)                    # 0xAE
-        self.command(SSD1306_SETDISPLAYCLOCKDIV)            # 0xD5
-        self.command(0x80)                                  # the suggested ratio 0x80
-        self.command(SSD1306_SETMULTIPLEX)                  # 0xA8
-        self.command(0x3F)
-        self.command(SSD1306_SETDISPLAYOFFSET)              # 0xD3
-        self.command(0x0)                                   # no offset
-        self.command(SSD1306_SETSTARTLINE | 0x0)            # line #0
-        self.command(SSD1306_CHARGEPUMP)                    # 0x8D
-        if self._vccstate == SSD1306_EXTERNALVCC:
-            self.command(0x10)
-        else:
-            self.command(0x14)
-        self.command(SSD1306_MEMORYMODE)                    # 0x20
-        self.command(0x00)                                  # 0x0 act like ks0108
-        self.command(SSD1306_SEGREMAP | 0x1)
-        self.command(SSD1306_COMSCANDEC)
-        self.command(SSD1306_SETCOMPINS)                    # 0xDA
-        self.command(0x12)
-        self.command(SSD1306_SETCONTRAST)                   # 0x81
-        if self._vccstate == SSD1306_EXTERNALVCC:
-            self.command(0x9F)
-        else:
-            self.command(0xCF)
-        self.command(SSD1306_SETPRECHARGE)                  # 0xd9
-        if self._vccstate == SSD1306_EXTERNALVCC:
-            self.command(0x22)
-        else:
-            self.command(0xF1)
-        self.command(SSD1306_SETVCOMDETECT)                 # 0xDB
-        self.command(0x40)
-        self.command(SSD1306_DISPLAYALLON_RESUME)           # 0xA4
-        self.command(SSD1306_NORMALDISPLAY)                 # 0xA6
+        # 128x64 pixel specific initialization, sent as a single transfer.
+        external = self._vccstate == SSD1306_EXTERNALVCC
+        self.commands([
+            SSD1306_DISPLAYOFF,                                 # 0xAE
+            SSD1306_SETDISPLAYCLOCKDIV, 0x80,                   # 0xD5, the suggested ratio 0x80
+            SSD1306_SETMULTIPLEX, 0x3F,                         # 0xA8
+            SSD1306_SETDISPLAYOFFSET, 0x0,                      # 0xD3, no offset
+            SSD1306_SETSTARTLINE | 0x0,                         # line #0
+            SSD1306_CHARGEPUMP, 0x10 if external else 0x14,     # 0x8D
+            SSD1306_MEMORYMODE, 0x00,                           # 0x20, 0x0 act like ks0108
+            SSD1306_SEGREMAP | 0x1,
+            SSD1306_COMSCANDEC,
+            SSD1306_SETCOMPINS, 0x12,                           # 0xDA
+            SSD1306_SETCONTRAST, 0x9F if external else 0xCF,    # 0x81
+            SSD1306_SETPRECHARGE, 0x22 if external else 0xF1,   # 0xd9
+            SSD1306_SETVCOMDETECT, 0x40,                        # 0xDB
+            SSD1306_DISPLAYALLON_RESUME,                        # 0xA4
+            SSD1306_NORMALDISPLAY])                             # 0xA6
 
 
 class SSD1306_128_32(SSD1306Base):
     def __init__(self, rst, dc=None, sclk=None, din=None, cs=None, gpio=None,
                  spi=None, i2c_bus=None, i2c_address=SSD1306_I2C_ADDRESS,
-                 i2c=None):
+                 i2c=None, i2c_chunk_size=16):
         # Call base class constructor.
         super(SSD1306_128_32, self).__init__(128, 32, rst, dc, sclk, din, cs,
-                                             gpio, spi, i2c_bus, i2c_address, i2c)
+                                             gpio, spi, i2c_bus, i2c_address, i2c,
+                                             i2c_chunk_size)
 
     def _initialize(self):
-        # 128x32 pixel specific initialization.
-        self.command(SSD1306_DISPLAYOFF)                    # 0xAE
-        self.command(SSD1306_SETDISPLAYCLOCKDIV)            # 0xD5
-        self.command(0x80)                                  # the suggested ratio 0x80
-        self.command(SSD1306_SETMULTIPLEX)                  # 0xA8
-        self.command(0x1F)
-        self.command(SSD1306_SETDISPLAYOFFSET)              # 0xD3
-        self.command(0x0)                                   # no offset
-        self.command(SSD1306_SETSTARTLINE | 0x0)            # line #0
-        self.command(SSD1306_CHARGEPUMP)                    # 0x8D
-        if self._vccstate == SSD1306_EXTERNALVCC:
-            self.command(0x10)
-        else:
-            self.command(0x14)
-        self.command(SSD1306_MEMORYMODE)                    # 0x20
-        self.command(0x00)                                  # 0x0 act like ks0108
-        self.command(SSD1306_SEGREMAP | 0x1)
-        self.command(SSD1306_COMSCANDEC)
-        self.command(SSD1306_SETCOMPINS)                    # 0xDA
-        self.command(0x02)
-        self.command(SSD1306_SETCONTRAST)                   # 0x81
-        self.command(0x8F)
-        self.command(SSD1306_SETPRECHARGE)                  # 0xd9
-        if self._vccstate == SSD1306_EXTERNALVCC:
-            self.command(0x22)
-        else:
-            self.command(0xF1)
-        self.command(SSD1306_SETVCOMDETECT)                 # 0xDB
-        self.command(0x40)
-        self.command(SSD1306_DISPLAYALLON_RESUME)           # 0xA4
-        self.command(SSD1306_NORMALDISPLAY)                 # 0xA6
+        # 128x32 pixel specific initialization, sent as a single transfer.
+        external = self._vccstate == SSD1306_EXTERNALVCC
+        self.commands([
+            SSD1306_DISPLAYOFF,                                 # 0xAE
+            SSD1306_SETDISPLAYCLOCKDIV, 0x80,                   # 0xD5, the suggested ratio 0x80
+            SSD1306_SETMULTIPLEX, 0x1F,                         # 0xA8
+            SSD1306_SETDISPLAYOFFSET, 0x0,                      # 0xD3, no offset
+            SSD1306_SETSTARTLINE | 0x0,                         # line #0
+            SSD1306_CHARGEPUMP, 0x10 if external else 0x14,     # 0x8D
+            SSD1306_MEMORYMODE, 0x00,                           # 0x20, 0x0 act like ks0108
+            SSD1306_SEGREMAP | 0x1,
+            SSD1306_COMSCANDEC,
+            SSD1306_SETCOMPINS, 0x02,                           # 0xDA
+            SSD1306_SETCONTRAST, 0x8F,                          # 0x81
+            SSD1306_SETPRECHARGE, 0x22 if external else 0xF1,   # 0xd9
+            SSD1306_SETVCOMDETECT, 0x40,                        # 0xDB
+            SSD1306_DISPLAYALLON_RESUME,                        # 0xA4
+            SSD1306_NORMALDISPLAY])                             # 0xA6
 
 
 class SSD1306_96_16(SSD1306Base):
     def __init__(self, rst, dc=None, sclk=None, din=None, cs=None, gpio=None,
                  spi=None, i2c_bus=None, i2c_address=SSD1306_I2C_ADDRESS,
-                 i2c=None):
+                 i2c=None, i2c_chunk_size=16):
         # Call base class constructor.
         super(SSD1306_96_16, self).__init__(96, 16, rst, dc, sclk, din, cs,
-                                            gpio, spi, i2c_bus, i2c_address, i2c)
+                                            gpio, spi, i2c_bus, i2c_address, i2c,
+                                            i2c_chunk_size)
 
     def _initialize(self):
-        # 128x32 pixel specific initialization.
-        self.command(SSD1306_DISPLAYOFF)                    # 0xAE
-        self.command(SSD1306_SETDISPLAYCLOCKDIV)            # 0xD5
-        self.command(0x60)                                  # the suggested ratio 0x60
-        self.command(SSD1306_SETMULTIPLEX)                  # 0xA8
-        self.command(0x0F)
-        self.command(SSD1306_SETDISPLAYOFFSET)              # 0xD3
-        self.command(0x0)                                   # no offset
-        self.command(SSD1306_SETSTARTLINE | 0x0)            # line #0
-        self.command(SSD1306_CHARGEPUMP)                    # 0x8D
-        if self._vccstate == SSD1306_EXTERNALVCC:
-            self.command(0x10)
-        else:
-            self.command(0x14)
-        self.command(SSD1306_MEMORYMODE)                    # 0x20
-        self.command(0x00)                                  # 0x0 act like ks0108
-        self.command(SSD1306_SEGREMAP | 0x1)
-        self.command(SSD1306_COMSCANDEC)
-        self.command(SSD1306_SETCOMPINS)                    # 0xDA
-        self.command(0x02)
-        self.command(SSD1306_SETCONTRAST)                   # 0x81
-        self.command(0x8F)
-        self.command(SSD1306_SETPRECHARGE)                  # 0xd9
-        if self._vccstate == SSD1306_EXTERNALVCC:
-            self.command(0x22)
-        else:
-            self.command(0xF1)
-        self.command(SSD1306_SETVCOMDETECT)                 # 0xDB
-        self.command(0x40)
-        self.command(SSD1306_DISPLAYALLON_RESUME)           # 0xA4
-        self.command(SSD1306_NORMALDISPLAY)                 # 0xA6
\ No newline at end of file
+        # 128x32 pixel specific initialization, sent as a single transfer.
+        external = self._vccstate == SSD1306_EXTERNALVCC
+        self.commands([
+            SSD1306_DISPLAYOFF,                                 # 0xAE
+            SSD1306_SETDISPLAYCLOCKDIV, 0x60,                   # 0xD5, the suggested ratio 0x60
+            SSD1306_SETMULTIPLEX, 0x0F,                         # 0xA8
+            SSD1306_SETDISPLAYOFFSET, 0x0,                      # 0xD3, no offset
+            SSD1306_SETSTARTLINE | 0x0,                         # line #0
+            SSD1306_CHARGEPUMP, 0x10 if external else 0x14,     # 0x8D
+            SSD1306_MEMORYMODE, 0x00,                           # 0x20, 0x0 act like ks0108
+            SSD1306_SEGREMAP | 0x1,
+            SSD1306_COMSCANDEC,
+            SSD1306_SETCOMPINS, 0x02,                           # 0xDA
+            SSD1306_SETCONTRAST, 0x8F,                          # 0x81
+            SSD1306_SETPRECHARGE, 0x22 if external else 0xF1,   # 0xd9
+            SSD1306_SETVCOMDETECT, 0x40,                        # 0xDB
+            SSD1306_DISPLAYALLON_RESUME,                        # 0xA4
+            SSD1306_NORMALDISPLAY])                             # 0xA6
@@ -1,47 +1,335 @@
 import os
 import sys
-import subprocess
 import time
+import math
+import socket
+import struct
+import fcntl
+import threading
+import traceback
+from collections import namedtuple
+from types import MappingProxyType
 
-class Statistics:
-    def __init__(self):
-        self.commands = {
-            "ip": "hostname -I | cut -d' ' -f1",
-            "hostname": "cat /etc/hostname",
-            "cpu": "cut -f 1 -d \" \" /proc/loadavg",
-            "ram": "free -m | awk 'NR==2{printf \"%s\", $3}'",
-            "ram_max": "free -m | awk 'NR==2{printf \"%s\", $2}'",
-            "disk": "df -h | awk '$NF==\"/\"{printf \"%d\", $3}'",
-            "disk_max": "df -h | awk '$NF==\"/\"{printf \"%d\", $2}'",
-            "temperature": "vcgencmd measure_temp" 
-        }
+from history import MetricHistory
 
-        self.values = {}
-        self.last_update = 0
+# ioctl returning the IPv4 address of an interface
+SIOCGIFADDR = 0x8915
 
-        self.update()
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+def meminfo():
+    # /proc/meminfo in kB, keyed by field name
+    fields = {}
+    for line in read_file("/proc/meminfo").splitlines():
+        name, value = line.split(":", 1)
+        fields[name] = int(value.split()[0])
+    return fields
+
+def df_gigabytes(size):
+    # Size in whole GiB the way `df -h` rounds it (up) and the old awk
+    # printf "%d" then truncated it
+    gigabytes = size/1024**3
+    if gigabytes < 10:
+        return int(math.ceil(gigabytes*10)/10)
+    return int(math.ceil(gigabytes))
+
+def interface_addresses():
+    # IPv4 addresses of the interfaces that are up, loopback excluded, in
+    # interface order like `hostname -I`
+    addresses = []
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for _, name in socket.if_nameindex():
+            try:
+                request = struct.pack("256s", name.encode()[:15])
+                address = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, request)[20:24])
+            except OSError:
+                # No IPv4 address on this interface
+                continue
+            if not address.startswith("127."):
+                addresses.append(address)
+    return addresses
+
+def collect_ip():
+    addresses = interface_addresses()
+    return addresses[0] if addresses else ""
+
+def collect_hostname():
+    return read_file("/etc/hostname")
+
+def collect_load():
+    return read_file("/proc/loadavg").split()[0]
+
+class CpuUsage:
+    # CPU utilization from the jiffies in /proc/stat, diffed between samples.
+    # All cpu statistics are collected in one pass, so a sample is shared by
+    # the reads within max_age seconds of it.
+    def __init__(self, max_age=0.5):
+        self.max_age = max_age
+        # line name ("cpu", "cpu0", ...) -> jiffies of the previous sample
+        self.previous = {}
+        self.usage = {}
+        self.sampled = None
+        self.sample()
+
+    def read(self):
+        jiffies = {}
+        for line in read_file("/proc/stat").splitlines():
+            if not line.startswith("cpu"):
+                break
+            fields = line.split()
+            # user nice system idle iowait irq softirq steal; guest time is
+            # already counted in user and nice
+            jiffies[fields[0]] = [int(field) for field in fields[1:9]]
+        return jiffies
 
-        
-    def update(self):
-        if time.time() - self.last_update >= 10:
-            for key, command in self.commands.items():
-                self.values[key] = subprocess.check_output(command, shell=True).decode("utf-8")
+    def sample(self):
+        now = time.monotonic()
+        if self.sampled is not None and now - self.sampled < self.max_age:
+            return self.usage
+        jiffies = self.read()
+        usage = {}
+        for name, current in jiffies.items():
+            # The first sample is the average since boot
+            previous = self.previous.get(name, [0]*len(current))
+            delta = [c - p for c, p in zip(current, previous)]
+            total = sum(delta)
+            if total <= 0:
+                usage[name] = self.usage.get(name, (0.0, 0.0, 0.0))
+                continue
+            idle, iowait, steal = delta[3], delta[4], delta[7]
+            # (busy %, iowait %, steal %)
+            usage[name] = ((total - idle - iowait)/total*100, iowait/total*100, steal/total*100)
+        self.previous = jiffies
+        self.usage = usage
+        self.sampled = now
+        return usage
 
-            if "temperature" in self.values:
-                self.values["temperature"] = self.values["temperature"].replace("temp=","").replace("'C","").strip()
+    def cores(self):
+        return sorted((name for name in self.usage if name != "cpu"), key=lambda name: int(name[3:]))
 
-            for key, value in self.values.items():
-                try:
-                    self.values[key] = float(self.values[key])
-                except ValueError:
-                    self.values[key] = self.values[key].strip()
-                    
-            self.last_update = time.time()
+    def collector(self, name, field=0):
+        # Collector of one utilization figure of one line of /proc/stat
+        return lambda: self.sample()[name][field]
 
+def collect_ram():
+    # Used memory in MiB as `free -m` (procps-ng 4) reports it
+    fields = meminfo()
+    return (fields["MemTotal"] - fields["MemAvailable"])//1024
+
+def collect_ram_max():
+    return meminfo()["MemTotal"]//1024
+
+def collect_disk():
+    stat = os.statvfs("/")
+    return df_gigabytes((stat.f_blocks - stat.f_bfree)*stat.f_frsize)
+
+def collect_disk_max():
+    stat = os.statvfs("/")
+    return df_gigabytes(stat.f_blocks*stat.f_frsize)
+
+def collect_temperature():
+    # SoC temperature in degrees Celsius, to one decimal like vcgencmd
+    return round(int(read_file("/sys/class/thermal/thermal_zone0/temp"))/1000, 1)
+
+class Snapshot(namedtuple("Snapshot", ["values", "updated"])):
+    # Immutable statistics as of one sampling pass: read-only key -> value
+    # and key -> time.monotonic() the value was collected
     def get(self, key):
-        self.update()
-        if key in self.values:
-            return self.values[key]
-        else:
+        return self.values.get(key)
+
+    def age(self, key, now=None):
+        # Seconds since the value was collected, None if it never was
+        if key not in self.updated:
             return None
+        if now is None:
+            now = time.monotonic()
+        return now - self.updated[key]
+
+    def ages(self):
+        now = time.monotonic()
+        return {key: self.age(key, now) for key in self.values}
 
+class Statistics:
+    def __init__(self, background=True):
+        # key -> (collector, seconds a value stays fresh, None for ever)
+        self.metrics = {}
+        self.values = {}
+        # key -> time.monotonic() the value was last collected
+        self.updated = {}
+        # key -> MetricHistory of the statistics that keep one
+        self.history = {}
+        # Serializes collecting with registering statistics
+        self.lock = threading.RLock()
+        # Guards the histories only, held for an append or a query but never
+        # while collecting, so readers do not wait for e.g. an I2C read
+        self.history_lock = threading.Lock()
+        # Set to have the sampler look at the statistics again right away
+        self.wakeup = threading.Event()
+        self.published = Snapshot(MappingProxyType({}), MappingProxyType({}))
+
+        # Each statistic is read straight from the kernel, no processes are
+        # started; see benchmark_statistics.py for the old shell commands
+        self.register("ip", collect_ip, ttl=60)
+        self.register("hostname", collect_hostname, ttl=3600)
+        # cpu is the busy percentage of all cores, cpu0... of each core
+        self.cpu_usage = CpuUsage()
+        self.register("cpu", self.cpu_usage.collector("cpu"), ttl=2, history=True)
+        self.register("cpu_iowait", self.cpu_usage.collector("cpu", 1), ttl=2)
+        self.register("cpu_steal", self.cpu_usage.collector("cpu", 2), ttl=2)
+        for core in self.cpu_usage.cores():
+            self.register(core, self.cpu_usage.collector(core), ttl=2)
+        self.register("load", collect_load, ttl=5)
+        self.register("ram", collect_ram, ttl=5, history=True)
+        self.register("ram_max", collect_ram_max, ttl=3600)
+        self.register("disk", collect_disk, ttl=60, history=True)
+        self.register("disk_max", collect_disk_max, ttl=3600)
+        self.register("temperature", collect_temperature, ttl=10, history=True)
+
+        self.update()
+
+        # With background sampling a thread refreshes statistics as they go
+        # stale and readers only ever look at the published snapshot;
+        # without, get() refreshes the requested statistic itself
+        self.background = background
+        self.stopping = False
+        self.sampler_thread = None
+        if background:
+            self.sampler_thread = threading.Thread(target=self.sample, daemon=True)
+            self.sampler_thread.start()
+
+    def register(self, key, collector, ttl=10, history=False):
+        # Add or replace a statistic, collector() is called without arguments
+        # whenever the value is older than ttl seconds.  With history the
+        # numeric values are also kept in a MetricHistory.
+        with self.lock:
+            self.metrics[key] = (collector, ttl)
+            self.updated.pop(key, None)
+            with self.history_lock:
+                if history:
+                    self.history.setdefault(key, MetricHistory())
+                else:
+                    self.history.pop(key, None)
+        self.wakeup.set()
+
+    def unregister(self, key):
+        with self.lock:
+            self.metrics.pop(key, None)
+            self.values.pop(key, None)
+            self.updated.pop(key, None)
+            with self.history_lock:
+                self.history.pop(key, None)
+            self.publish()
+
+    @property
+    def collectors(self):
+        return {key: collector for key, (collector, _) in self.metrics.items()}
+
+    def stale(self, key, now=None):
+        if key not in self.updated:
+            return True
+        ttl = self.metrics[key][1]
+        if ttl is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        return now - self.updated[key] >= ttl
+
+    def next_due(self):
+        # time.monotonic() the next statistic goes stale
+        due = [self.updated.get(key, 0) + ttl for key, (_, ttl) in self.metrics.items() if ttl is not None]
+        return min(due) if due else time.monotonic() + 3600
+
+    def refresh(self, key):
+        collector, _ = self.metrics[key]
+        self.updated[key] = time.monotonic()
+        try:
+            value = collector()
+        except (OSError, ValueError, KeyError, IndexError):
+            # Not available on this system, e.g. no thermal zone; tried
+            # again once the ttl has passed
+            self.values.pop(key, None)
+            return
+        except Exception:
+            # A broken collector, e.g. one registered by a plugin, only
+            # loses its own statistic and is tried again after the ttl
+            traceback.print_exc()
+            self.values.pop(key, None)
+            return
+        # Numbers are floats and anything else a stripped string, as before
+        # when the values were parsed from command output
+        try:
+            self.values[key] = float(value)
+        except (TypeError, ValueError):
+            self.values[key] = str(value).strip()
+            return
+        with self.history_lock:
+            if key in self.history:
+                self.history[key].append(self.values[key], self.updated[key])
+
+    def publish(self):
+        # Replacing the reference is atomic, readers never need the lock
+        self.published = Snapshot(MappingProxyType(dict(self.values)), MappingProxyType(dict(self.updated)))
+
+    def update(self, force=False):
+        # Refresh every stale statistic, or all of them with force
+        with self.lock:
+            now = time.monotonic()
+            refreshed = False
+            for key in list(self.metrics):
+                if force or self.stale(key, now):
+                    self.refresh(key)
+                    refreshed = True
+            if refreshed:
+                self.publish()
+
+    def sample(self):
+        while not self.stopping:
+            try:
+                self.update()
+            except Exception:
+                # Keep sampling, the statistics must never freeze
+                traceback.print_exc()
+            self.wakeup.wait(max(self.next_due() - time.monotonic(), 0.01))
+            self.wakeup.clear()
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+        if self.sampler_thread is not None:
+            self.sampler_thread.join()
+
+    def snapshot(self):
+        # Most recent values and when they were collected, never blocks on
+        # collecting when sampling in the background
+        if not self.background:
+            self.update()
+        return self.published
+
+    def age(self, key):
+        return self.published.age(key)
+
+    def series(self, key, window, points):
+        # Mean of the statistic per slot of window/points seconds, see
+        # MetricHistory.series(); empty without history
+        with self.history_lock:
+            if key not in self.history:
+                return ()
+            return self.history[key].series(window, points)
+
+    def summary(self, key, window):
+        # min, max, mean and p95 over the last window seconds
+        with self.history_lock:
+            if key not in self.history:
+                return None
+            return self.history[key].summary(window)
+
+    def get(self, key):
+        if not self.background and key in self.metrics:
+            # Only the requested statistic is refreshed, and only when stale
+            with self.lock:
+                if self.stale(key):
+                    self.refresh(key)
+                    self.publish()
+        return self.published.get(key)
@@ -0,0 +1,223 @@
+from PIL import Image, ImageChops
+
+from ssd1306 import (SSD1306_SETCONTRAST, SSD1306_DISPLAYALLON_RESUME,
+                     SSD1306_DISPLAYALLON, SSD1306_NORMALDISPLAY,
+                     SSD1306_INVERTDISPLAY, SSD1306_DISPLAYOFF,
+                     SSD1306_DISPLAYON, SSD1306_SETDISPLAYOFFSET,
+                     SSD1306_SETCOMPINS, SSD1306_SETVCOMDETECT,
+                     SSD1306_SETDISPLAYCLOCKDIV, SSD1306_SETPRECHARGE,
+                     SSD1306_SETMULTIPLEX, SSD1306_MEMORYMODE,
+                     SSD1306_COLUMNADDR, SSD1306_PAGEADDR, SSD1306_CHARGEPUMP,
+                     SSD1306_ACTIVATE_SCROLL, SSD1306_DEACTIVATE_SCROLL,
+                     SSD1306_SET_VERTICAL_SCROLL_AREA,
+                     SSD1306_RIGHT_HORIZONTAL_SCROLL,
+                     SSD1306_LEFT_HORIZONTAL_SCROLL,
+                     SSD1306_VERTICAL_AND_RIGHT_HORIZONTAL_SCROLL,
+                     SSD1306_VERTICAL_AND_LEFT_HORIZONTAL_SCROLL)
+
+
+# Number of parameter bytes that follow each multi-byte command.
+COMMAND_PARAMETERS = {
+    SSD1306_SETCONTRAST: 1,
+    SSD1306_MEMORYMODE: 1,
+    SSD1306_COLUMNADDR: 2,
+    SSD1306_PAGEADDR: 2,
+    SSD1306_SETMULTIPLEX: 1,
+    SSD1306_SETDISPLAYOFFSET: 1,
+    SSD1306_SETDISPLAYCLOCKDIV: 1,
+    SSD1306_SETPRECHARGE: 1,
+    SSD1306_SETCOMPINS: 1,
+    SSD1306_SETVCOMDETECT: 1,
+    SSD1306_CHARGEPUMP: 1,
+    SSD1306_SET_VERTICAL_SCROLL_AREA: 2,
+    SSD1306_RIGHT_HORIZONTAL_SCROLL: 6,
+    SSD1306_LEFT_HORIZONTAL_SCROLL: 6,
+    SSD1306_VERTICAL_AND_RIGHT_HORIZONTAL_SCROLL: 5,
+    SSD1306_VERTICAL_AND_LEFT_HORIZONTAL_SCROLL: 5,
+}
+
+MEMORYMODE_HORIZONTAL = 0x00
+MEMORYMODE_VERTICAL = 0x01
+MEMORYMODE_PAGE = 0x02
+
+
+class VirtualGPIO(object):
+    """GPIO stand-in for a virtual display, which has no pins to drive."""
+
+    def setup(self, pin, mode):
+        pass
+
+    def set_high(self, pin):
+        pass
+
+    def set_low(self, pin):
+        pass
+
+
+class VirtualSSD1306(object):
+    """Emulated SSD1306 controller on an I2C bus.  It acts both as the I2C
+    provider and as the device handed to SSD1306Base, decodes the command and
+    data stream into an emulated display RAM and counts the bus traffic.
+
+    Use it in place of a real display like so:
+
+        device = VirtualSSD1306()
+        display = SSD1306_128_64(rst=None, i2c=device, gpio=VirtualGPIO())
+    """
+
+    def __init__(self, width=128, height=64):
+        self.width = width
+        self.height = height
+        self.pages = height//8
+        self.address = None
+        self.ram = bytearray(width*self.pages)
+        self.display_on = False
+        self.inverted = False
+        self.all_on = False
+        self.contrast = 0x7F
+        self.memory_mode = MEMORYMODE_PAGE
+        self.column_start = 0
+        self.column_end = width-1
+        self.page_start = 0
+        self.page_end = self.pages-1
+        self.column = 0
+        self.page = 0
+        self.scrolling = False
+        self.scroll_setup = None
+        # Command bytes waiting for the rest of their parameters.
+        self._pending = []
+        self.reset_counters()
+
+    def reset_counters(self):
+        """Reset the bus traffic counters."""
+        self.transactions = 0
+        self.bytes = 0
+        self.command_bytes = 0
+        self.data_bytes = 0
+
+    def get_i2c_device(self, address, **kwargs):
+        """I2C provider interface, returns this device for any address."""
+        self.address = address
+        return self
+
+    def write8(self, register, value):
+        """Write a single byte after the given control byte."""
+        self.writeList(register, [value])
+
+    def writeList(self, register, data):
+        """Write a run of bytes after the given control byte.  Bit 6 of the
+        control byte selects data (1) or commands (0).
+        """
+        self.transactions += 1
+        self.bytes += len(data) + 1
+        if register & 0x40:
+            self.data_bytes += len(data)
+            for value in data:
+                self._write_ram(value)
+        else:
+            self.command_bytes += len(data)
+            for value in data:
+                self._command(value)
+
+    def _command(self, value):
+        self._pending.append(value)
+        parameters = COMMAND_PARAMETERS.get(self._pending[0], 0)
+        if len(self._pending) <= parameters:
+            return
+        command, arguments = self._pending[0], self._pending[1:]
+        self._pending = []
+        if command == SSD1306_DISPLAYON:
+            self.display_on = True
+        elif command == SSD1306_DISPLAYOFF:
+            self.display_on = False
+        elif command == SSD1306_NORMALDISPLAY:
+            self.inverted = False
+        elif command == SSD1306_INVERTDISPLAY:
+            self.inverted = True
+        elif command == SSD1306_DISPLAYALLON_RESUME:
+            self.all_on = False
+        elif command == SSD1306_DISPLAYALLON:
+            self.all_on = True
+        elif command == SSD1306_SETCONTRAST:
+            self.contrast = arguments[0]
+        elif command == SSD1306_MEMORYMODE:
+            self.memory_mode = arguments[0] & 0x03
+        elif command == SSD1306_COLUMNADDR:
+            self.column_start, self.column_end = arguments
+            self.column = self.column_start
+        elif command == SSD1306_PAGEADDR:
+            self.page_start, self.page_end = arguments
+            self.page = self.page_start
+        elif command == SSD1306_ACTIVATE_SCROLL:
+            self.scrolling = True
+        elif command == SSD1306_DEACTIVATE_SCROLL:
+            self.scrolling = False
+        elif command in (SSD1306_RIGHT_HORIZONTAL_SCROLL, SSD1306_LEFT_HORIZONTAL_SCROLL,
+                         SSD1306_VERTICAL_AND_RIGHT_HORIZONTAL_SCROLL,
+                         SSD1306_VERTICAL_AND_LEFT_HORIZONTAL_SCROLL):
+            self.scroll_setup = (command, tuple(arguments))
+        elif self.memory_mode == MEMORYMODE_PAGE and command <= 0x0F:
+            self.column = (self.column & 0xF0) | command
+        elif self.memory_mode == MEMORYMODE_PAGE and 0x10 <= command <= 0x1F:
+            self.column = (self.column & 0x0F) | ((command & 0x0F) << 4)
+        elif self.memory_mode == MEMORYMODE_PAGE and 0xB0 <= command <= 0xB7:
+            self.page = command & 0x07
+        # Anything else only configures the panel hardware.
+
+    def _write_ram(self, value):
+        if self.page < self.pages and self.column < self.width:
+            self.ram[self.page*self.width + self.column] = value
+        if self.memory_mode == MEMORYMODE_HORIZONTAL:
+            self.column += 1
+            if self.column > self.column_end:
+                self.column = self.column_start
+                self.page = self.page_start if self.page >= self.page_end else self.page+1
+        elif self.memory_mode == MEMORYMODE_VERTICAL:
+            self.page += 1
+            if self.page > self.page_end:
+                self.page = self.page_start
+                self.column = self.column_start if self.column >= self.column_end else self.column+1
+        else:
+            # Page addressing wraps within the current page.
+            self.column = 0 if self.column >= self.width-1 else self.column+1
+
+    def to_image(self, panel=True):
+        """Return the display RAM as a 1 bit Python Imaging Library image.  With
+        panel True the display on/off, entire display on and inverse display
+        settings are applied, so the image shows what the panel would.
+        """
+        if panel and (not self.display_on or self.all_on):
+            return Image.new('1', (self.width, self.height), 255 if self.display_on else 0)
+        # Unpack the page-ordered bytes into one row of pixels per line.
+        rows = bytearray(self.width*self.height)
+        for page in range(self.pages):
+            columns = self.ram[page*self.width:(page+1)*self.width]
+            for bit in range(8):
+                row = (page*8 + bit)*self.width
+                rows[row:row+self.width] = bytes(255 if value >> bit & 1 else 0 for value in columns)
+        image = Image.frombytes('L', (self.width, self.height), bytes(rows)).convert('1')
+        if panel and self.inverted:
+            image = ImageChops.invert(image)
+        return image
+
+    def to_array(self, panel=True):
+        """Return the displayed pixels as a height x width NumPy array of 0/1."""
+        import numpy as np
+        image = self.to_image(panel)
+        return (np.asarray(image.convert('L')) > 0).astype(np.uint8)
+
+    def save_png(self, path, panel=True, scale=1):
+        """Save the displayed pixels as PNG, optionally scaled up."""
+        image = self.to_image(panel)
+        if scale != 1:
+            image = image.resize((self.width*scale, self.height*scale), Image.NEAREST)
+        image.save(path, 'PNG')
+
+    def counters(self):
+        """Return the bus traffic counters as a dict."""
+        return {
+            'transactions': self.transactions,
+            'bytes': self.bytes,
+            'command_bytes': self.command_bytes,
+            'data_bytes': self.data_bytes,
+        }